@@ -69,12 +69,22 @@ common_modules = [
     'tabkit.safe_popen',
     'tabkit.datasrc',
     'tabkit.header',
+    'tabkit.index',
+    'tabkit.colstore',
+    'tabkit.blockgz',
     'tabkit.utils',
     'tabkit.miniast',
     'tabkit.awk',
     'tabkit.awk_grp',
     'tabkit.awk_expr',
     'tabkit.awk_types',
+    'tabkit.bloom',
+    'tabkit.kvstore',
+    'tabkit.awk_py',
+    'tabkit.awk_pipe',
+    'tabkit.join',
+    'tabkit._odict',
+    'tabkit.regroup',
     'tabkit._fileparser',
     'tabkit.pyparser',
 ]
@@ -104,6 +114,9 @@ def main(dstdir):
         ],
         modules = [
             'tabkit.utils',
+            'tabkit.index',
+            'tabkit.colstore',
+            'tabkit.blockgz',
             'tabkit.header',
             'tabkit.datasrc',
             'tabkit.safe_popen',
@@ -123,6 +136,9 @@ def main(dstdir):
         modules = [
             'tabkit.datasrc',
             'tabkit.header',
+            'tabkit.index',
+            'tabkit.colstore',
+            'tabkit.blockgz',
             'tabkit.utils',
             'tabkit._odict',
             'tabkit.regroup',
@@ -135,6 +151,9 @@ def main(dstdir):
         modules = [
             'tabkit.datasrc',
             'tabkit.header',
+            'tabkit.index',
+            'tabkit.colstore',
+            'tabkit.blockgz',
             'tabkit.utils',
             'tabkit.safe_popen',
         ],
@@ -148,6 +167,7 @@ def main(dstdir):
             ('tcut',      'tcut'),
             ('tmap_awk',  'tmap_awk'),
             ('tgrp_awk',  'tgrp_awk'),
+            ('tpipe',     'tpipe'),
             ('tsrt',      'tsrt'),
             ('tjoin',     'tjoin'),
             ('tpaste',    'tpaste'),
@@ -156,6 +176,9 @@ def main(dstdir):
             ('tparallel', 'tparallel'),
             ('tunconcat', 'tunconcat'),
             ('trl',       'trl'),
+            ('tindex',    'tindex'),
+            ('tbloom',    'tbloom'),
+            ('tdict',     'tdict'),
         ],
     )
 
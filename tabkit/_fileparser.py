@@ -1,7 +1,7 @@
 import time
 from warnings import warn
 from collections import namedtuple
-from itertools import islice
+from itertools import islice, izip
 from array import array
 
 def ChunkIter( iterable, chunk_size ):
@@ -34,7 +34,7 @@ def SimpleFileParser(fields_spec, field_separator=None, ignore_errors=None,
 
     return simple_file_parser
 
-def FileParser(rec_parser, field_separator=None, ignore_errors=None):
+def FileParser(rec_parser, field_separator=None, ignore_errors=None, field_indexes=None):
     """
     >>> src = ['a b:c 1', 'd e:f 2', 'h i:g 3']
     >>> parser = FileParser(
@@ -62,8 +62,21 @@ def FileParser(rec_parser, field_separator=None, ignore_errors=None):
     >>> for rec in parser(src):
     ...     print rec
     Rec(first='a', tail=[Rec(second=['b', 'c']), Rec(second=['d', 'e'])])
+
+    >>> src = ['a b:c 1 x y z']
+    >>> parser = FileParser(
+    ...     field_separator = ' ',
+    ...     rec_parser = RecParser((('third', int), ('first', str))),
+    ...     field_indexes = [2, 0],
+    ... )
+    >>> for rec in parser(src):
+    ...     print rec
+    Rec(third=1, first='a')
     """
-    lines_splitter = SimpleLinesSplitter(field_separator or '\t')
+    if field_indexes is None:
+        lines_splitter = SimpleLinesSplitter(field_separator or '\t')
+    else:
+        lines_splitter = ProjectedLinesSplitter(field_indexes, field_separator or '\t')
     records_parser = RecordsParser(rec_parser, ignore_errors)
     def parse_file(fileobj):
         for rec in records_parser(lines_splitter(fileobj)):
@@ -76,6 +89,95 @@ def SimpleLinesSplitter(field_separator=None):
             yield line.strip('\n').split(field_separator)
     return simple_lines_splitter
 
+def ProjectedLinesSplitter(field_indexes, field_separator=None):
+    """
+    Splits only the leading part of the line that holds the requested fields,
+    the rest of the line is left unsplit.
+
+    >>> splitter = ProjectedLinesSplitter([3, 0], '\\t')
+    >>> list(splitter(['a\\tb\\tc\\td\\te\\tf\\n', 'a\\tb\\tc\\td\\n', 'a\\tb\\n']))
+    [['d', 'a'], ['d', 'a'], ['a']]
+    """
+    field_indexes = list(field_indexes)
+    maxsplit = max(field_indexes) + 1
+    def projected_lines_splitter(lines):
+        for line in lines:
+            fields = line.rstrip('\n').split(field_separator, maxsplit)
+            try:
+                projected = [fields[idx] for idx in field_indexes]
+            except IndexError:
+                # short line, let the record parser complain about it
+                projected = [fields[idx] for idx in field_indexes if idx < len(fields)]
+            yield projected
+    return projected_lines_splitter
+
+def ColumnsFileParser(fields_spec, batch_size, field_separator=None, field_indexes=None):
+    """
+    Parses lines by batches of batch_size, every batch is a record of columns.
+    fields_spec items are (name, column_conv), column_conv gets a tuple
+    of string values of the field and returns the column.
+
+    >>> src = ['a 1 0.5', 'b 2 1.5', 'c 3 2.5']
+    >>> parser = ColumnsFileParser(
+    ...     fields_spec = (
+    ...         ('name', list),
+    ...         ('count', lambda values: array('l', map(int, values))),
+    ...     ),
+    ...     batch_size = 2,
+    ...     field_separator = ' ',
+    ... )
+    >>> for batch in parser(src):
+    ...     print batch
+    Batch(name=['a', 'b'], count=array('l', [1, 2]))
+    Batch(name=['c'], count=array('l', [3]))
+    >>> list(parser(['a 1', 'b']))
+    Traceback (most recent call last):
+        ...
+    FileParseError: Line 2: Record has 1 field(s), expected 2-2
+    >>> list(parser(['a 1', 'b 2', 'c 3', 'd x']))
+    Traceback (most recent call last):
+        ...
+    FileParseError: Line 4: Failed to convert field 'count' (value 'x'): ValueError("invalid literal for int() with base 10: 'x'",)
+    """
+    if field_indexes is None:
+        lines_splitter = SimpleLinesSplitter(field_separator or '\t')
+    else:
+        lines_splitter = ProjectedLinesSplitter(field_indexes, field_separator or '\t')
+    Batch = namedtuple('Batch', [name for name, conv in fields_spec])
+    fields_count = len(fields_spec)
+    conv_errors = (ValueError, TypeError, OverflowError)
+
+    def parse_batches(lines):
+        line_no = 0
+        for rows in ChunkIter(lines_splitter(lines), batch_size):
+            columns = zip(*rows)
+            if len(columns) < fields_count:
+                for i, row in enumerate(rows):
+                    if len(row) < fields_count:
+                        raise FileParseError(
+                            line_no + i,
+                            RecParseError(len(row), fields_count, fields_count),
+                        )
+            args = []
+            for values, (name, conv) in izip(columns, fields_spec):
+                try:
+                    args.append(conv(values))
+                except conv_errors:
+                    # find out the bad value
+                    for i, value in enumerate(values):
+                        try:
+                            conv((value,))
+                        except conv_errors, err:
+                            raise FileParseError(
+                                line_no + i,
+                                RecParseConvError(name, value, err),
+                            )
+                    raise
+            line_no += len(rows)
+            yield Batch(*args)
+
+    return parse_batches
+
 def RecordsParser(rec_parser, warn_on_errors=None):
     if warn_on_errors == None:
         warn_on_errors = False
@@ -146,6 +248,92 @@ def RecParser(fields_spec, required=None, tail_spec=None):
 
     return parse
 
+class LazyField(object):
+    """
+    Non-data descriptor: converts the raw field value on the first access
+    and stores the result in the record's __dict__, so the next access
+    does not reach the descriptor at all.
+    """
+    def __init__(self, name, idx, conv):
+        self.name = name
+        self.idx = idx
+        self.conv = conv
+
+    def __get__(self, rec, owner):
+        if rec is None:
+            return self
+        try:
+            value = rec._raw[self.idx]
+        except IndexError:
+            value = None
+        else:
+            try:
+                value = self.conv(value)
+            except (ValueError, TypeError), err:
+                raise RecParseConvError(self.name, value, err)
+        rec.__dict__[self.name] = value
+        return value
+
+class LazyRecBase(object):
+    _fields = ()
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        for name in self._fields:
+            yield getattr(self, name)
+
+    def __getitem__(self, idx):
+        return getattr(self, self._fields[idx])
+
+    def _asdict(self):
+        return dict((name, getattr(self, name)) for name in self._fields)
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            self.__class__.__name__,
+            ', '.join('%s=%r' % (name, getattr(self, name)) for name in self._fields),
+        )
+
+def LazyRecParser(fields_spec, required=None):
+    """
+    Same as RecParser, but the record keeps the raw split line
+    and converts each field only when it is accessed for the first time.
+    Conversion errors are raised on access.
+
+    >>> parse = LazyRecParser((('a', str), ('b', int), ('c', float)))
+    >>> rec = parse(['x', '1', 'bad'])
+    >>> rec.b, rec[0], len(rec)
+    (1, 'x', 3)
+    >>> rec.c
+    Traceback (most recent call last):
+        ...
+    RecParseConvError: Failed to convert field 'c' (value 'bad'): ValueError('could not convert string to float: bad',)
+    >>> parse(['x', '1', '0.5'])
+    Rec(a='x', b=1, c=0.5)
+    >>> parse(['x'])
+    Traceback (most recent call last):
+        ...
+    RecParseError: Record has 1 field(s), expected 3-3
+    """
+    required = required or len(fields_spec)
+
+    attrs = dict(_fields=tuple(name for name, rec_type in fields_spec))
+    for idx, (name, rec_type) in enumerate(fields_spec):
+        attrs[name] = LazyField(name, idx, rec_type)
+    Rec = type('Rec', (LazyRecBase,), attrs)
+
+    def parse(fields):
+        if len(fields) < required:
+            raise RecParseError(len(fields), required, len(fields_spec))
+        return Rec(fields)
+
+    return parse
+
 def SimpleRecParser(first_conv, tail_conv=None):
     def parse(fields):
         tail = [ tail_conv(value) for value in fields[1:] ]
@@ -36,6 +36,8 @@ OP_MAP = {
 }
 
 EXT_FUNC_REQ = set()
+# functions of the python engine only, see tabkit.awk_py
+PY_ONLY_FUNCS = set(['in_bloom'])
 EXT_FUNC_SRC = {
     'crc32' : '''function crc32(str)
 {
@@ -106,8 +108,14 @@ EXT_FUNC_SRC = {
     }
 
     __hash_id_map_next_id = (length(__hash_id_map) + 1) "";
+    __hash_id_map_first = 1;
     while ((getline __hash_id_map_line < fname) > 0){
         split(__hash_id_map_line, __hash_id_map_sline, "\t")
+        if (__hash_id_map_first && __hash_id_map_sline[1] == "TDICT1"){
+            print "Error:", fname, "is a tdict file, use --engine=python" > "/dev/stderr";
+            exit 1;
+        }
+        __hash_id_map_first = 0;
         __hash_id_map_tables[(__hash_id_map_next_id "\t" __hash_id_map_sline[1])] = __hash_id_map_sline[2]
     }
     close(fname);
@@ -393,6 +401,21 @@ def func_mapper(ctx):
 
 
 
+        @staticmethod
+        def in_bloom(fname_expr, key_expr):
+            # bloom filter file written by tbloom build
+            EXT_FUNC_REQ.add('in_bloom')
+
+            return RowExprFunc(
+                func = 'in_bloom',
+                args = [
+                    _get_var('_in_bloom', fname_expr),
+                    _get_var('_in_bloom', key_expr),
+                ],
+            )
+
+
+
         @staticmethod
         def strptime(format, timestr):
             if not isinstance(format, RowExprConst) or format.type != "str":
@@ -545,6 +568,8 @@ class AwkScript(object):
         self.begin = begin or AwkBlock([])
         self.end = end or AwkBlock([])
     def tostr(self, ident=0, newline=''):
+        for func_name in EXT_FUNC_REQ & PY_ONLY_FUNCS:
+            raise Exception('%s() is supported only by --engine=python' % (func_name,))
         awk_str = '\n'.join(EXT_FUNC_SRC[func_name] for func_name in EXT_FUNC_REQ)
         if self.begin.lines:
             awk_str += 'BEGIN' + AwkBlock([self.begin]).tostr(ident, newline, 0) + newline
@@ -566,7 +591,7 @@ def parse_expr(ctx, tree, subparser=None):
         if ctx.has_var(tree.id):
             return RowExprVar(ctx, tree.id)
         elif tree.id in ['NR', 'NF', 'FILENAME', 'RSTART', 'RLENGTH']:
-            return RowExprBuiltinVar(tree.id)
+            return RowExprBuiltinVar(ctx.builtin_vars.get(tree.id, tree.id))
         else:
             raise Exception('Variable %r not found' % (tree.id,))
     elif isinstance(tree, _ast.Tuple):
@@ -684,7 +709,17 @@ def awk_filter_map(data_desc, filter_strs, map_strs):
     >>> print desc
     DataDesc([DataField('a', 'any'), DataField('b', 'any')])
     """
-    ctx = ExprContext(data_desc)
+    ctx, filter_expr = parse_filter_map(data_desc, filter_strs, map_strs)
+    awk_cmd, output_desc = awk_filter_map_from_context(ctx, filter_expr, data_desc.order)
+    if output_desc:
+        output_desc.meta = data_desc.meta
+    return awk_cmd, output_desc or data_desc
+
+def parse_filter_map(data_desc, filter_strs, map_strs, namer=None, field_exprs=None, builtin_vars=None):
+    """
+    Parses -f and -o expressions, returns (ctx, filter_expr).
+    """
+    ctx = ExprContext(data_desc, namer, field_exprs, builtin_vars)
 
     # parse map
     for map_expr_str in map_strs:
@@ -710,12 +745,40 @@ def awk_filter_map(data_desc, filter_strs, map_strs):
     else:
         filter_expr = RowExprOp('&&', [parse_expr(ctx, node) for node in nodes])
 
-    awk_cmd, output_desc = awk_filter_map_from_context(ctx, filter_expr, data_desc.order)
-    if output_desc:
-        output_desc.meta = data_desc.meta
-    return awk_cmd, output_desc or data_desc
+    return ctx, filter_expr
+
+def awk_print(output_exprs, output_desc):
+    if output_exprs:
+        return AwkBlock(["print(" + ','.join(expr.tostr() for expr in output_exprs) + ")"])
+    else:
+        return AwkBlock(["print"])
 
-def awk_filter_map_from_context(ctx, filter_expr=None, order=None, already_assigned=None):
+def awk_filter_map_from_context(ctx, filter_expr=None, order=None, already_assigned=None, emit=None):
+    """
+    emit(output_exprs, output_desc) returns AwkBlock that outputs the row,
+    awk_print by default.
+    """
+    assign_before_if, assign_after_if, output_exprs, output_desc = filter_map_plan(
+        ctx, filter_expr, order, already_assigned
+    )
+
+    awk_cmd = (emit or awk_print)(output_exprs, output_desc)
+    if assign_after_if:
+        awk_cmd = AwkBlock(['; '.join(expr.tostr() for expr in assign_after_if)]) + awk_cmd
+    if filter_expr:
+        awk_cmd = AwkBlock([AwkHeadBlock('if(%s)' % (filter_expr.tostr(),), awk_cmd)])
+    if assign_before_if:
+        awk_cmd = AwkBlock(['; '.join(expr.tostr() for expr in assign_before_if)]) + awk_cmd
+    awk_cmd = AwkScript(awk_cmd, begin=AwkBlock(['OFS="\\t"']))
+
+    return awk_cmd, output_desc
+
+def filter_map_plan(ctx, filter_expr=None, order=None, already_assigned=None):
+    """
+    Backend-independent part of filter/map translation.
+    Returns (assign_before_if, assign_after_if, output_exprs, output_desc),
+    output_desc is None if there are no output fields (the input line is printed as is).
+    """
     order = order or []
     already_assigned = already_assigned or set()
 
@@ -747,18 +810,6 @@ def awk_filter_map_from_context(ctx, filter_expr=None, order=None, already_assig
                 if refered_field not in kept_fields or kept_fields[refered_field] != refered_field:
                     kept_fields[refered_field] = name
 
-    if output_exprs:
-        awk_cmd = AwkBlock(["print(" + ','.join(expr.tostr() for expr in output_exprs) + ")"])
-    else:
-        awk_cmd = AwkBlock(["print"])
-    if assign_after_if:
-        awk_cmd = AwkBlock(['; '.join(expr.tostr() for expr in assign_after_if)]) + awk_cmd
-    if filter_expr:
-        awk_cmd = AwkBlock([AwkHeadBlock('if(%s)' % (filter_expr.tostr(),), awk_cmd)])
-    if assign_before_if:
-        awk_cmd = AwkBlock(['; '.join(expr.tostr() for expr in assign_before_if)]) + awk_cmd
-    awk_cmd = AwkScript(awk_cmd, begin=AwkBlock(['OFS="\\t"']))
-
     # construct data_desc
     output_fields = []
     new_order = []
@@ -773,9 +824,10 @@ def awk_filter_map_from_context(ctx, filter_expr=None, order=None, already_assig
         ))
 
     if output_fields:
-        return awk_cmd, DataDesc(output_fields, new_order)
+        output_desc = DataDesc(output_fields, new_order)
     else:
-        return awk_cmd, None
+        output_desc = None
+    return assign_before_if, assign_after_if, output_exprs, output_desc
 
 def _test(): # pylint: disable-msg=E0102
     import doctest
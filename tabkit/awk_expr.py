@@ -43,6 +43,8 @@ class RowExprField(object):
         if self.name.startswith('__'):
             raise Exception("Variable name can't start with '__'")
     def tostr(self):
+        if self.ctx.field_exprs is not None:
+            return self.ctx.field_exprs[self.name]
         return '$' + str(self.ctx.data_desc.field_index(self.name) + 1)
     def find(self, node_type, node_props):
         return match_node(self, node_type, node_props)
@@ -174,24 +176,33 @@ class Namer(object):
     >>> n.get_name('a', 'a')
     a1
     """
-    def __init__(self):
+    def __init__(self, tag=''):
+        self.tag = tag
         self.names = {}
         self.cnts = {}
     def get_name(self, prefix, obj):
         if (prefix, obj) in self.names:
             return self.names[(prefix, obj)]
         else:
-            name = prefix + str(self.cnts.setdefault(prefix, 0))
+            name = prefix + str(self.cnts.setdefault(prefix, 0)) + self.tag
             self.names[(prefix, obj)] = name
             self.cnts[prefix] += 1
             return name
 
 class ExprContext(object):
-    def __init__(self, data_desc, namer=None):
+    """
+    field_exprs maps field names to awk expressions to use instead of $N
+    and builtin_vars maps NR, NF, ... to their replacements,
+    both are used when the context reads output of another stage
+    of the same awk program.
+    """
+    def __init__(self, data_desc, namer=None, field_exprs=None, builtin_vars=None):
         self.data_desc = data_desc
         self.vars = {}
         self.varnames = []
         self.namer = namer or Namer()
+        self.field_exprs = field_exprs
+        self.builtin_vars = builtin_vars or {}
     def has_field(self, name):
         return self.data_desc.has_field(name)
     def has_var(self, name):
@@ -239,12 +250,13 @@ class ExprContext(object):
         return self.namer.get_name(prefix, obj)
 
 class _GrpExprFunc(RowExprVar):
-    def __init__(self, name, func, init, update, args, end=None):
+    def __init__(self, name, func, init, update, args, end=None, params=None):
         self.name = name
         self.func = func
         self.init = init
         self.update = update
         self.args = args
+        self.params = params or {}
         if end:
             self.end = end
     def tostr(self):
@@ -1,4 +1,6 @@
+import re
 import _ast
+from textwrap import dedent
 
 from tabkit.miniast import parse
 from tabkit.utils import partial
@@ -9,12 +11,14 @@ from tabkit.awk import awk_filter_map_from_context, match_node
 from tabkit.awk import ExprContext, RowExprOp, RowExprVar, RowExprConst, RowExprField
 from tabkit.awk import AwkBlock, AwkScript, AwkHeadBlock
 from tabkit.awk_expr import _GrpExprFunc, RowExprAssign, Namer
+from tabkit.awk_py import PyExprCompiler, PyBlock, PyHeadBlock, PyScript
+from tabkit.awk_py import py_filter_map_from_context, awk_str_value
 
 class GrpExprFuncMaker(object):
     def __init__(self, prefix, namer):
         self.namer = namer
         self.prefix = prefix
-    def __call__(self, func, init, update, args, end=None):
+    def __call__(self, func, init, update, args, end=None, params=None):
         return _GrpExprFunc(
             name = self.namer.get_name(
                 self.prefix,
@@ -25,6 +29,7 @@ class GrpExprFuncMaker(object):
             update = update,
             args = args,
             end = end,
+            params = params,
         )
 
 def grp_ifmax(maker, args):
@@ -107,6 +112,7 @@ def grp_concat(maker, args):
         init = '%(var)s = "";',
         update = '%(var)s = (%(var)s=="")?(%(rowexpr0)s):(%(var)s"' + delim.const + '"%(rowexpr0)s);',
         args = (field_name,),
+        params = dict(delim=delim.const),
     )
 
 def grp_concat_uniq(maker, args):
@@ -130,6 +136,7 @@ def grp_concat_uniq(maker, args):
             '%(var)s = (%(var)s=="")?(%(var)s_heap[%(var)s_i]):(%(var)s "' + delim.const + '" %(var)s_heap[%(var)s_i]);'
         'delete %(var)s_heap;',
         args = (field_name,),
+        params = dict(delim=delim.const),
     )
 
 def grp_concat_sorted(maker, args):
@@ -173,6 +180,7 @@ def grp_concat_sorted(maker, args):
             delete %(var)s_heap_count
         '''.strip()),
         args=(field_name,),
+        params=dict(delim=delim.const),
     )
 
 def grp_chain_concat_uniq(maker, args):
@@ -188,7 +196,7 @@ def grp_chain_concat_uniq(maker, args):
         raise Exception("'delim' arg to 'grp_chain_concat_uniq' function should be a const of type 'str'")
 
     return maker(
-        func = "concat_uniq",
+        func = "chain_concat_uniq",
         init = '%(var)s = "";',
         update = 'split(%(rowexpr0)s, %(var)s_unjoin,"' + delim.const + '");'
         'for (%(var)s_item in %(var)s_unjoin) %(var)s_heap[%(var)s_unjoin[%(var)s_item]]=""',
@@ -197,6 +205,7 @@ def grp_chain_concat_uniq(maker, args):
             '%(var)s = (%(var)s=="")?(%(var)s_heap[%(var)s_i]):(%(var)s "' + delim.const + '" %(var)s_heap[%(var)s_i]);'
         'delete %(var)s_heap;',
         args = (field_name,),
+        params = dict(delim=delim.const),
     )
 
 
@@ -229,6 +238,7 @@ def grp_concat_sample(maker, args):
             '%(var)s = (%(var)s=="")?(%(var)s_heap[%(var)s_i]):(%(var)s "' + delim.const + '" %(var)s_heap[%(var)s_i]);'
         'delete %(var)s_heap;',
         args = (field_name,),
+        params = dict(delim=delim.const, limit=limit.const),
     )
 
 
@@ -282,6 +292,109 @@ def grp_last(maker, args):
         raise Exception("'last' function takes 1 argument")
     return maker(func="last", init='%(var)s = "";', update='%(var)s = %(rowexpr0)s;', args=args)
 
+def _grp_chain(func, base, maker, field_name, delim, base_args=()):
+    """
+    Makes function applying base to every item of field_name split by delim.
+    """
+    parts = {}
+    def capture(**kwargs):
+        parts.update(kwargs)
+    base(capture, [field_name] + list(base_args))
+    params = dict(parts.get('params') or {})
+    params['chain_delim'] = delim
+    return maker(
+        func = func,
+        init = parts['init'],
+        update = (
+            '%(var)s_nsplit = split(%(rowexpr0)s, %(var)s_unjoin, "' + delim + '");'
+            'for (%(var)s_k=1; %(var)s_k<=%(var)s_nsplit; %(var)s_k++) {'
+            + parts['update'].replace('%(rowexpr0)s', '%(var)s_unjoin[%(var)s_k]')
+            + '}'
+        ),
+        args = (field_name,),
+        end = parts.get('end'),
+        params = params,
+    )
+
+def _check_delim(func, delim):
+    if not isinstance(delim, RowExprConst) or delim.type != "str":
+        raise Exception("'delim' arg to '%s' function should be a const of type 'str'" % (func,))
+
+def grp_chain_concat_sorted(maker, args):
+    if len(args) != 2:
+        raise Exception("'chain_concat_sorted' function takes 2 arguments (field and delimiter)")
+    field_name, delim = args
+    _check_delim('chain_concat_sorted', delim)
+    return _grp_chain('chain_concat_sorted', grp_concat_sorted, maker, field_name, delim.const, [delim])
+
+def grp_chain_concat_sample(maker, args):
+    if len(args) != 3:
+        raise Exception("'chain_concat_sample' function takes 3 arguments (field, limit, delimiter)")
+    field_name, limit, delim = args
+    _check_delim('chain_concat_sample', delim)
+    return _grp_chain('chain_concat_sample', grp_concat_sample, maker, field_name, delim.const, [limit, delim])
+
+def grp_chain_median(maker, args):
+    if len(args) != 2:
+        raise Exception("'chain_median' function takes 2 arguments (field and delimiter)")
+    field_name, delim = args
+    _check_delim('chain_median', delim)
+    return _grp_chain('chain_median', grp_median, maker, field_name, delim.const)
+
+# values of median are passed between --partial and --merge joined by this
+MEDIAN_DELIM = '\x1f'
+
+def _partial_ifcmp(cmp_builder):
+    def partial_ifcmp(maker, func):
+        return [('', func), ('_cmp', cmp_builder(maker, func.args[:1]))]
+    return partial_ifcmp
+
+def _partial_median(maker, func):
+    return [('', grp_concat(maker, [func.args[0], RowExprConst(MEDIAN_DELIM)]))]
+
+# state of a grouping function printed by tgrp_awk --partial:
+# list of (column suffix, grouping function computing the column),
+# by default the function itself
+PARTIAL_MAP = {
+    'ifmax' : _partial_ifcmp(grp_max),
+    'ifmin' : _partial_ifcmp(grp_min),
+    'median' : _partial_median,
+}
+
+def _merge_with(builder, *params):
+    def merge(maker, func, columns):
+        return builder(maker, [columns['']] + [RowExprConst(func.params[name]) for name in params])
+    return merge
+
+def _merge_ifcmp(builder):
+    def merge_ifcmp(maker, func, columns):
+        return builder(maker, [columns['_cmp'], columns['']])
+    return merge_ifcmp
+
+def _merge_median(maker, func, columns):
+    return grp_chain_median(maker, [columns[''], RowExprConst(MEDIAN_DELIM)])
+
+# how tgrp_awk --merge combines partial states,
+# every primitive function of FUNC_MAP needs a rule here
+# (avg and var are expressed via sum and cnt)
+MERGE_MAP = {
+    'ifmax' : _merge_ifcmp(grp_ifmax),
+    'ifmin' : _merge_ifcmp(grp_ifmin),
+    'min' : _merge_with(grp_min),
+    'max' : _merge_with(grp_max),
+    'sum' : _merge_with(grp_sum),
+    'product' : _merge_with(grp_product),
+    'cnt' : _merge_with(grp_sum),
+    'concat' : _merge_with(grp_concat, 'delim'),
+    'concat_uniq' : _merge_with(grp_chain_concat_uniq, 'delim'),
+    'chain_concat_uniq' : _merge_with(grp_chain_concat_uniq, 'delim'),
+    'concat_sorted' : _merge_with(grp_chain_concat_sorted, 'delim'),
+    'concat_sample' : _merge_with(grp_chain_concat_sample, 'limit', 'delim'),
+    'median' : _merge_median,
+    'first' : _merge_with(grp_first),
+    'last' : _merge_with(grp_last),
+}
+
 FUNC_MAP = {
     'ifmin' : grp_ifmin,
     'ifmax' : grp_ifmax,
@@ -302,6 +415,139 @@ FUNC_MAP = {
     'last' : grp_last,
 }
 
+# python engine implementations of FUNC_MAP functions,
+# templates get %(var)s and %(rowexprN)s like awk ones,
+# %(numN)s and %(strN)s are numeric and string values of the N-th argument,
+# %(cmp)s is a comparison function suitable for the first argument,
+# params of the function (delim, limit) are substituted as python literals.
+# kind is the kind of the result: 'num', 'str', 'mixed' or 'argN'.
+PY_FUNC_MAP = {
+    'ifmax' : dict(
+        kind = 'arg1',
+        init = '%(var)s_cmp = -_RT_INF',
+        update = dedent('''
+            %(var)s_tmp = %(rowexpr0)s
+            if %(cmp)s(%(var)s_tmp, %(var)s_cmp) > 0:
+                %(var)s_cmp = %(var)s_tmp
+                %(var)s = %(rowexpr1)s
+        ''').strip(),
+    ),
+    'ifmin' : dict(
+        kind = 'arg1',
+        init = '%(var)s_cmp = _RT_INF',
+        update = dedent('''
+            %(var)s_tmp = %(rowexpr0)s
+            if %(cmp)s(%(var)s_tmp, %(var)s_cmp) < 0:
+                %(var)s_cmp = %(var)s_tmp
+                %(var)s = %(rowexpr1)s
+        ''').strip(),
+    ),
+    'max' : dict(
+        kind = 'arg0',
+        init = '%(var)s_init = 0',
+        update = dedent('''
+            %(var)s_tmp = %(rowexpr0)s
+            if %(var)s_init == 0:
+                %(var)s_init = 1
+                %(var)s = %(var)s_tmp
+            elif %(cmp)s(%(var)s_tmp, %(var)s) > 0:
+                %(var)s = %(var)s_tmp
+        ''').strip(),
+    ),
+    'min' : dict(
+        kind = 'arg0',
+        init = '%(var)s_init = 0',
+        update = dedent('''
+            %(var)s_tmp = %(rowexpr0)s
+            if %(var)s_init == 0:
+                %(var)s_init = 1
+                %(var)s = %(var)s_tmp
+            elif %(cmp)s(%(var)s_tmp, %(var)s) < 0:
+                %(var)s = %(var)s_tmp
+        ''').strip(),
+    ),
+    'sum' : dict(kind='num', init='%(var)s = 0', update='%(var)s += %(num0)s'),
+    'product' : dict(kind='num', init='%(var)s = 1', update='%(var)s *= %(num0)s'),
+    'cnt' : dict(kind='num', init='%(var)s = 0', update='%(var)s += 1'),
+    'concat' : dict(
+        kind = 'str',
+        init = "%(var)s = ''",
+        update = dedent('''
+            if %(var)s == '':
+                %(var)s = %(str0)s
+            else:
+                %(var)s += %(delim)s + %(str0)s
+        ''').strip(),
+    ),
+    'concat_uniq' : dict(
+        kind = 'str',
+        init = "%(var)s = ''; %(var)s_heap = set()",
+        update = '%(var)s_heap.add(%(str0)s)',
+        end = '%(var)s = _rt_concat(%(var)s, sorted(%(var)s_heap), %(delim)s); %(var)s_heap.clear()',
+    ),
+    'concat_sorted' : dict(
+        kind = 'str',
+        init = "%(var)s = ''; %(var)s_heap = []",
+        update = '%(var)s_heap.append(%(str0)s)',
+        end = '%(var)s = _rt_concat(%(var)s, sorted(%(var)s_heap), %(delim)s); del %(var)s_heap[:]',
+    ),
+    'chain_concat_uniq' : dict(
+        kind = 'str',
+        init = "%(var)s = ''; %(var)s_heap = set()",
+        update = '%(var)s_heap.update(_rt_split(%(rowexpr0)s, %(delim)s))',
+        end = '%(var)s = _rt_concat(%(var)s, sorted(%(var)s_heap), %(delim)s); %(var)s_heap.clear()',
+    ),
+    'concat_sample' : dict(
+        kind = 'str',
+        init = "%(var)s = ''; %(var)s_cnt = 0; %(var)s_heap = set()",
+        update = dedent('''
+            %(var)s_tmp = %(str0)s
+            if %(var)s_tmp not in %(var)s_heap and %(var)s_cnt < %(limit)s:
+                %(var)s_heap.add(%(var)s_tmp)
+                %(var)s_cnt += 1
+        ''').strip(),
+        end = '%(var)s = _rt_concat(%(var)s, sorted(%(var)s_heap), %(delim)s); %(var)s_heap.clear()',
+    ),
+    'median' : dict(
+        kind = 'mixed',
+        init = '%(var)s_arr = []',
+        update = '%(var)s_arr.append(%(rowexpr0)s)',
+        end = '%(var)s = _rt_median(%(var)s_arr)',
+    ),
+    'first' : dict(
+        kind = 'arg0',
+        init = "%(var)s = ''; %(var)s_unset = 1",
+        update = dedent('''
+            if %(var)s_unset:
+                %(var)s = %(rowexpr0)s
+                %(var)s_unset = 0
+        ''').strip(),
+    ),
+    'last' : dict(kind='arg0', init="%(var)s = ''", update='%(var)s = %(rowexpr0)s'),
+}
+
+def _py_chain(base):
+    update = PY_FUNC_MAP[base]['update']
+    for pattern, value in [
+            ('%(rowexpr0)s', '%(var)s_item'),
+            ('%(str0)s', '%(var)s_item'),
+            ('%(num0)s', '_rt_num(%(var)s_item)'),
+            ]:
+        update = update.replace(pattern, value)
+    return dict(
+        PY_FUNC_MAP[base],
+        update = (
+            'for %(var)s_item in _rt_split(%(rowexpr0)s, %(chain_delim)s):\n'
+            + '\n'.join('    ' + line for line in update.split('\n'))
+        ),
+    )
+
+PY_FUNC_MAP.update(
+    chain_concat_sorted = _py_chain('concat_sorted'),
+    chain_concat_sample = _py_chain('concat_sample'),
+    chain_median = _py_chain('median'),
+)
+
 def parse_grpexpr(grp_ctx, tree, row_ctx, maker):
     if isinstance(tree, _ast.Call) and tree.func.id in FUNC_MAP:
         if tree.keywords:
@@ -322,15 +568,21 @@ def find_grp_funcs(ctx):
             func_dict[node.name] = node
     return func_dict.items()
 
-def awk_grp(data_desc, key_str, grp_expr_tuples, output_only_assigned=True, expose_groups=False):
-    namer = Namer()
+def parse_grp(data_desc, key_str, grp_expr_tuples, output_only_assigned=True,
+        namer=None, field_exprs=None, builtin_vars=None):
+    """
+    Parses grouping keys and -o/-O expressions.
+    Returns (keys, grp_ctx, acc_ctx, out_ctx), where keys is a list of
+    (row_expr, key_name, row_key_name).
+    """
+    namer = namer or Namer()
     acc_maker = GrpExprFuncMaker('__acc_', namer)
     grp_maker = GrpExprFuncMaker('__grp_', namer)
-    key_ctx = ExprContext(data_desc, namer)
-    row_ctx = ExprContext(data_desc, namer)
-    acc_ctx = ExprContext(DataDesc([],[]), namer)
-    grp_ctx = ExprContext(DataDesc([],[]), namer)
-    out_ctx = ExprContext(DataDesc([],[]), namer)
+    key_ctx = ExprContext(data_desc, namer, field_exprs, builtin_vars)
+    row_ctx = ExprContext(data_desc, namer, field_exprs, builtin_vars)
+    acc_ctx = ExprContext(DataDesc([],[]), namer, builtin_vars=builtin_vars)
+    grp_ctx = ExprContext(DataDesc([],[]), namer, builtin_vars=builtin_vars)
+    out_ctx = ExprContext(DataDesc([],[]), namer, builtin_vars=builtin_vars)
 
     # parse key expr
     keys = []
@@ -385,11 +637,108 @@ def awk_grp(data_desc, key_str, grp_expr_tuples, output_only_assigned=True, expo
             else:
                 raise Exception('Unknown grouping type %r' % (grp_type,))
 
+    return keys, grp_ctx, acc_ctx, out_ctx
+
+def _partial_column(func_name):
+    return func_name.lstrip('_')
+
+def _partial_state(maker, func):
+    if func.func in PARTIAL_MAP:
+        return PARTIAL_MAP[func.func](maker, func)
+    return [('', func)]
+
+def partial_grp(parsed):
+    """
+    Turns parse_grp result into grouping printing keys (key0, key1, ...)
+    and states of grouping functions instead of -o expressions.
+    Such output of several parts of input is combined by merge_grp.
+    """
+    keys, grp_ctx, acc_ctx, out_ctx = parsed
+    if find_grp_funcs(acc_ctx):
+        raise Exception('-O is not supported with --partial/--merge')
+    namer = out_ctx.namer
+    maker = GrpExprFuncMaker('__grp_', namer)
+    part_grp_ctx = ExprContext(DataDesc([],[]), namer, builtin_vars=out_ctx.builtin_vars)
+    part_out_ctx = ExprContext(DataDesc([],[]), namer, builtin_vars=out_ctx.builtin_vars)
+    for num, (expr, name, row_name) in enumerate(keys):
+        part_out_ctx.set_var(name, RowExprAssign(name, expr))
+        column = 'key%d' % (num,)
+        part_out_ctx.set_var(column, RowExprAssign(column, RowExprVar(part_out_ctx, name)))
+    for name, func in sorted(find_grp_funcs(grp_ctx)):
+        if func.func not in MERGE_MAP:
+            raise Exception('Function %r does not support --partial/--merge' % (func.func,))
+        for suffix, state_func in _partial_state(maker, func):
+            column = _partial_column(name) + suffix
+            part_grp_ctx.set_var(column, RowExprAssign(column, state_func))
+            part_out_ctx.set_var(column, RowExprAssign(column, state_func))
+    return keys, part_grp_ctx, ExprContext(DataDesc([],[]), namer), part_out_ctx
+
+def merge_grp(parsed, partial_desc):
+    """
+    Turns parse_grp result into grouping of partial_grp output
+    described by partial_desc: keys are read from key0, key1, ...
+    and every grouping function is replaced by its MERGE_MAP rule.
+    Modifies parsed in place.
+    """
+    keys, grp_ctx, acc_ctx, out_ctx = parsed
+    if find_grp_funcs(acc_ctx):
+        raise Exception('-O is not supported with --partial/--merge')
+    part_ctx = ExprContext(partial_desc, out_ctx.namer)
+    maker = GrpExprFuncMaker('__grp_', out_ctx.namer)
+    def column(name):
+        if not partial_desc.has_field(name):
+            raise Exception('Field %r not found, input is not tgrp_awk --partial output' % (name,))
+        return RowExprField(part_ctx, name)
+
+    merged_keys = []
+    for num, (expr, name, row_name) in enumerate(keys):
+        key_expr = RowExprOp('', [column('key%d' % (num,)), RowExprConst("")])
+        merged_keys.append((key_expr, name, row_name))
+
+    merged = {}
+    for name, func in find_grp_funcs(grp_ctx):
+        columns = dict(
+            (suffix, column(_partial_column(name) + suffix))
+            for suffix, state_func in _partial_state(maker, func)
+        )
+        merged[name] = MERGE_MAP[func.func](maker, func, columns).__dict__
+    # the same function can be referenced by several nodes
+    for var_name, assign_expr in grp_ctx.itervars():
+        for node in assign_expr.find(_GrpExprFunc, {}):
+            if node.name in merged:
+                attrs = merged[node.name]
+                node.__dict__.clear()
+                node.__dict__.update(attrs)
+    return merged_keys, grp_ctx, acc_ctx, out_ctx
+
+def awk_grp(data_desc, key_str, grp_expr_tuples, output_only_assigned=True, expose_groups=False,
+        namer=None, field_exprs=None, builtin_vars=None, emit=None):
+    """
+    namer, field_exprs, builtin_vars and emit are used to embed grouping
+    into a larger awk program, see tabkit.awk_pipe.
+    """
+    parsed = parse_grp(
+        data_desc, key_str, grp_expr_tuples, output_only_assigned,
+        namer, field_exprs, builtin_vars,
+    )
+    return awk_grp_from_parsed(parsed, data_desc.order, key_str is None, expose_groups, emit)
+
+def awk_grp_from_parsed(parsed, order=None, print_last=False, expose_groups=False,
+        emit=None, ofmt=None):
+    """
+    Builds awk script from parse_grp result.
+    print_last prints the group even if input is empty,
+    ofmt sets awk OFMT (format of printed non-integer numbers).
+    """
+    keys, grp_ctx, acc_ctx, out_ctx = parsed
+    nr_var = out_ctx.builtin_vars.get('NR', 'NR')
+    print_last_var = '__print_last' + out_ctx.namer.tag
 
     # construct awk script
     print_awk, output_desc = awk_filter_map_from_context(
         out_ctx,
-        order = data_desc.order,
+        order = order,
+        emit = emit,
     )
     if output_desc is None:
         raise Exception('No output fields specified')
@@ -424,17 +773,18 @@ def awk_grp(data_desc, key_str, grp_expr_tuples, output_only_assigned=True, expo
     awk = AwkScript(
         begin = (
             print_awk.begin
+            + AwkBlock(['OFMT="%s"' % (ofmt,)] if ofmt else [])
             + init_grps
             + init_accs
-            + AwkBlock(['__print_last = ' + str(int(key_str == None))])
+            + AwkBlock([print_last_var + ' = ' + str(int(print_last))])
         ),
         end = AwkBlock() if expose_groups else AwkBlock([AwkHeadBlock(
-            'if(NR!=0 || __print_last==1)',
+            'if(%s!=0 || %s==1)' % (nr_var, print_last_var),
             end_grps + print_awk.main
         )]),
         main = (
             calc_row_keys
-            + AwkHeadBlock('if(NR==1)', update_keys)
+            + AwkHeadBlock('if(%s==1)' % (nr_var,), update_keys)
             + AwkHeadBlock('else', AwkBlock([
                 AwkHeadBlock('if(' + keys_changed_str + ')',
                     end_grps
@@ -451,6 +801,197 @@ def awk_grp(data_desc, key_str, grp_expr_tuples, output_only_assigned=True, expo
 
     return awk, output_desc
 
+def _py_grp_code(compiler, func, part):
+    tpl = PY_FUNC_MAP[func.func].get(part)
+    if not tpl:
+        return ''
+    args = dict(var=compiler.var(func.name))
+    for num, arg in enumerate(func.args):
+        args['rowexpr%s' % (num,)] = compiler.expr(arg)
+        args['num%s' % (num,)] = compiler.num(arg)
+        args['str%s' % (num,)] = compiler.str(arg)
+    if func.args:
+        args['cmp'] = 'cmp' if compiler.is_numeric(func.args[0]) else '_rt_cmp'
+    for name, value in func.params.iteritems():
+        if isinstance(value, str):
+            value = awk_str_value(value)
+        args[name] = repr(value)
+    return tpl % args
+
+def _py_grp_state(compiler, func):
+    """
+    Names of variables holding state of grouping function between rows.
+    """
+    var = compiler.var(func.name)
+    code = '\n'.join(_py_grp_code(compiler, func, part) for part in ('init', 'update', 'end'))
+    names = set(re.findall(re.escape(var) + r'(?:_[a-z]+)?\b', code))
+    names.add(var)
+    return sorted(name for name in names if not name.endswith('_tmp'))
+
+def py_grp(data_desc, key_str, grp_expr_tuples, output_only_assigned=True, expose_groups=False,
+        hash_groups=False, max_groups=None):
+    """
+    Same as awk_grp, but returns PyScript running in-process.
+
+    With hash_groups input does not need to be sorted: state of every
+    group is kept in a dict, groups are printed at the end in order
+    of their first appearance. max_groups limits the number of groups.
+
+    >>> from tabkit.header import parse_header
+    >>> from StringIO import StringIO
+    >>> script, desc = py_grp(parse_header('# k v'), 'k', [('grp', 's=sum(v); a=avg(v)')], False, hash_groups=True)
+    >>> print desc
+    DataDesc([DataField('k', 'any'), DataField('s', 'float'), DataField('a', 'float')])
+    >>> out = StringIO()
+    >>> script.run(['b\\t1\\n', 'a\\t2\\n', 'b\\t3\\n'], out)
+    >>> out.getvalue()
+    'b\\t4\\t2\\na\\t2\\t2\\n'
+    >>> script, desc = py_grp(parse_header('# k v'), 'k', [('grp', 's=sum(v)')], False, hash_groups=True, max_groups=1)
+    >>> script.run(['b\\t1\\n', 'a\\t2\\n'], out)
+    Traceback (most recent call last):
+    ...
+    Exception: More than 1 groups in hash mode
+    """
+    parsed = parse_grp(
+        data_desc, key_str, grp_expr_tuples, output_only_assigned
+    )
+    return py_grp_from_parsed(
+        parsed, data_desc.order, key_str is None, expose_groups, hash_groups, max_groups,
+    )
+
+def py_grp_from_parsed(parsed, order=None, print_last=False, expose_groups=False,
+        hash_groups=False, max_groups=None, ofmt=None):
+    """
+    Builds PyScript from parse_grp result, see awk_grp_from_parsed.
+    """
+    keys, grp_ctx, acc_ctx, out_ctx = parsed
+    if hash_groups and print_last:
+        hash_groups = False # the only group
+    if hash_groups and (expose_groups or find_grp_funcs(acc_ctx)):
+        raise Exception('Hash grouping does not support --expose-groups and -O')
+
+    compiler = PyExprCompiler(PY_FUNC_MAP)
+    compiler.ofmt = ofmt
+    for expr, name, row_name in keys:
+        compiler.var_kinds[name] = compiler.var_kinds[row_name] = compiler.kind(expr)
+
+    print_py, output_desc = py_filter_map_from_context(
+        compiler,
+        out_ctx,
+        order = order,
+    )
+    if output_desc is None:
+        raise Exception('No output fields specified')
+
+    init_grps = PyBlock()
+    init_accs = PyBlock()
+    calc_row_keys = PyBlock(compiler.nested_statements([expr for expr, name, row_name in keys]))
+    keys_changed = []
+    update_keys = PyBlock()
+    end_grps = PyBlock()
+
+    for expr, name, row_name in keys:
+        kind = compiler.kind(expr)
+        calc_row_keys.append(compiler.var(row_name) + ' = ' + compiler.expr(expr))
+        update_keys.append(compiler.var(name) + ' = ' + compiler.var(row_name))
+        keys_changed.append(compiler.compare(
+            '!=', compiler.var(name), kind, compiler.var(row_name), kind
+        ))
+
+    grp_funcs = find_grp_funcs(grp_ctx)
+    acc_funcs = find_grp_funcs(acc_ctx)
+    update_grps = PyBlock(compiler.nested_statements(
+        [arg for name, val in grp_funcs + acc_funcs for arg in val.args]
+    ))
+    update_accs = PyBlock()
+
+    for name, val in grp_funcs:
+        init_grps.append(_py_grp_code(compiler, val, 'init'))
+        update_grps.append(_py_grp_code(compiler, val, 'update'))
+        end_grps.append(_py_grp_code(compiler, val, 'end'))
+
+    for name, val in acc_funcs:
+        init_accs.append(_py_grp_code(compiler, val, 'init'))
+        update_accs.append(_py_grp_code(compiler, val, 'update'))
+        end_grps.append(_py_grp_code(compiler, val, 'end'))
+
+    if hash_groups:
+        state_vars = [
+            state_var
+            for name, val in grp_funcs
+            for state_var in _py_grp_state(compiler, val)
+        ]
+        return _py_hash_grp(
+            compiler, keys, calc_row_keys, state_vars,
+            init_grps, update_grps, end_grps, print_py, max_groups,
+        ), DataDesc(output_desc.fields, meta=output_desc.meta)
+
+    if expose_groups:
+        end = PyBlock()
+    elif print_last:
+        end = end_grps + print_py
+    else:
+        end = PyBlock([PyHeadBlock('if nr != 0', end_grps + print_py)])
+
+    script = PyScript(
+        begin = init_grps + init_accs,
+        end = end,
+        main = (
+            calc_row_keys
+            + PyHeadBlock('if nr == 1', update_keys)
+            + PyHeadBlock('elif ' + ' or '.join(keys_changed),
+                end_grps
+                + (print_py if not expose_groups else PyBlock())
+                + update_keys
+                + init_grps
+            )
+            + update_grps
+            + update_accs
+            + (print_py if expose_groups else PyBlock())
+        ),
+        compiler = compiler,
+    )
+
+    return script, output_desc
+
+def _py_hash_grp(compiler, keys, calc_row_keys, state_vars,
+        init_grps, update_grps, end_grps, print_py, max_groups):
+    row_key = '(%s,)' % (', '.join(compiler.var(row_name) for expr, name, row_name in keys),)
+    key_vars = '(%s,)' % (', '.join(compiler.var(name) for expr, name, row_name in keys),)
+    state = '(%s,)' % (', '.join(state_vars),) if state_vars else '()'
+
+    load_state = PyBlock(['h_state = h_groups.get(h_key)'])
+    new_group = init_grps + PyBlock(['h_keys.append(h_key)'])
+    if max_groups is not None:
+        new_group.append(PyHeadBlock('if len(h_keys) > %d' % (max_groups,), PyBlock([
+            "raise Exception('More than %d groups in hash mode')" % (max_groups,)
+        ])))
+    load_state.append(PyHeadBlock('if h_state is None', new_group))
+    if state_vars:
+        load_state.append(PyHeadBlock('else', PyBlock([state + ' = h_state'])))
+
+    return PyScript(
+        begin = PyBlock(['h_groups = {}', 'h_keys = []', 'h_cur = None']),
+        main = (
+            calc_row_keys
+            + PyBlock(['h_key = ' + row_key])
+            + PyHeadBlock('if h_key != h_cur', PyBlock([
+                PyHeadBlock('if h_cur is not None', PyBlock(['h_groups[h_cur] = ' + state])),
+                load_state,
+                'h_cur = h_key',
+            ]))
+            + update_grps
+        ),
+        end = PyBlock([
+            PyHeadBlock('if h_cur is not None', PyBlock(['h_groups[h_cur] = ' + state])),
+            PyHeadBlock('for h_key in h_keys', PyBlock(
+                ([state + ' = h_groups[h_key]'] if state_vars else [])
+                + [key_vars + ' = h_key']
+            ) + end_grps + print_py),
+        ]),
+        compiler = compiler,
+    )
+
 __test__ = dict(
     awk_grp1 = r"""
         >>> from tabkit.header import parse_header
@@ -0,0 +1,183 @@
+# coding: utf-8
+"""
+Fusion of tmap_awk/tgrp_awk stages into a single awk program.
+
+Every stage is compiled as usual, but instead of printing a row it runs
+the next stage on it. Output fields that just pass input fields through
+are referenced directly ($N), computed ones are joined and split into
+an array, so the next stage sees the same strnum values as it would
+reading them from a pipe.
+
+Stages are tuples:
+    ('map', filter_strs, map_strs)
+    ('grp', key_str, grp_expr_tuples, output_only_assigned, expose_groups)
+"""
+
+from tabkit.awk_expr import Namer, RowExprField
+from tabkit.awk import AwkBlock, AwkScript, awk_print, parse_filter_map, awk_filter_map_from_context
+from tabkit.awk_grp import awk_grp
+
+def _input_field_exprs(data_desc, field_exprs):
+    if field_exprs is not None:
+        return field_exprs
+    return dict(
+        (field.name, '$' + str(num + 1))
+        for num, field in enumerate(data_desc.fields)
+    )
+
+def _bind_outputs(output_exprs, output_desc, array_name):
+    """
+    Returns (AwkBlock, field_exprs) making output of a stage
+    available as input fields of the next one.
+    """
+    field_exprs = {}
+    computed = []
+    for field, expr in zip(output_desc.fields, output_exprs):
+        if isinstance(expr, RowExprField):
+            field_exprs[field.name] = expr.tostr()
+        else:
+            computed.append(expr)
+            field_exprs[field.name] = '%s[%d]' % (array_name, len(computed))
+    if not computed:
+        return AwkBlock(), field_exprs
+    return AwkBlock([
+        'split(%s, %s, "\\t")' % (
+            ' "\\t" '.join('(' + expr.tostr() + ')' for expr in computed),
+            array_name,
+        )
+    ]), field_exprs
+
+def _stage_awk(data_desc, stages, num, field_exprs):
+    stage = stages[0]
+    if num == 0:
+        namer = Namer()
+        builtin_vars = {}
+        counter = AwkBlock()
+    else:
+        namer = Namer('_p%d' % (num,))
+        builtin_vars = {
+            'NR': '__p%d_nr' % (num,),
+            'NF': str(len(data_desc.fields)),
+        }
+        counter = AwkBlock([builtin_vars['NR'] + '++'])
+
+    # the rest of the pipeline, filled in by emit
+    rest = []
+    def emit(output_exprs, output_desc):
+        if len(stages) == 1:
+            if not output_exprs and field_exprs is not None:
+                # $0 is the input of the first stage, not of this one
+                return AwkBlock(["print(" + ','.join(
+                    field_exprs[field.name] for field in data_desc.fields
+                ) + ")"])
+            return awk_print(output_exprs, output_desc)
+        if output_exprs:
+            bind, next_field_exprs = _bind_outputs(
+                output_exprs, output_desc, '__p%d' % (num + 1,)
+            )
+            next_desc = output_desc
+        else:
+            bind, next_field_exprs = AwkBlock(), _input_field_exprs(data_desc, field_exprs)
+            next_desc = data_desc
+        next_awk, next_output_desc = _stage_awk(next_desc, stages[1:], num + 1, next_field_exprs)
+        rest.append((next_awk, next_output_desc))
+        return bind + next_awk.main
+
+    if stage[0] == 'map':
+        filter_strs, map_strs = stage[1:]
+        ctx, filter_expr = parse_filter_map(
+            data_desc, filter_strs, map_strs, namer, field_exprs, builtin_vars
+        )
+        awk, output_desc = awk_filter_map_from_context(
+            ctx, filter_expr, data_desc.order, emit=emit
+        )
+        output_desc = output_desc or data_desc
+    elif stage[0] == 'grp':
+        key_str, grp_expr_tuples, output_only_assigned, expose_groups = stage[1:]
+        awk, output_desc = awk_grp(
+            data_desc, key_str, grp_expr_tuples, output_only_assigned, expose_groups,
+            namer, field_exprs, builtin_vars, emit,
+        )
+    else:
+        raise Exception('Unknown stage type %r' % (stage[0],))
+
+    awk = AwkScript(counter + awk.main, begin=awk.begin, end=awk.end)
+    if rest:
+        next_awk, output_desc = rest[0]
+        awk = AwkScript(
+            awk.main,
+            begin = awk.begin + AwkBlock([
+                line for line in next_awk.begin.lines if line != 'OFS="\\t"'
+            ]),
+            end = awk.end + next_awk.end,
+        )
+    return awk, output_desc
+
+def awk_pipeline(data_desc, stages):
+    """
+    >>> from tabkit.header import parse_header
+    >>> awk, desc = awk_pipeline(parse_header('# k a b'), [
+    ...     ('map', ['a>0'], ['k; c=length(b)']),
+    ...     ('grp', 'k', [('grp', 's=sum(c)')], False, False),
+    ...     ('map', ['s>10'], ['__all__']),
+    ... ])
+    >>> print desc
+    DataDesc([DataField('k', 'any'), DataField('s', 'float')])
+    >>> print awk.tostr(ident=4, newline='\\n')
+    BEGIN{
+        OFS="\\t";
+        __grp_0_p1 = 0;
+        __print_last_p1 = 0;
+    }
+    {
+        if(($2 > 0))
+        {
+            split((length($3)), __p1, "\\t");
+            __p1_nr++;
+            __row_key0_p1 = ($1  "");
+            if(__p1_nr==1)
+            {
+                __key0_p1 = __row_key0_p1;
+            }
+            else
+            {
+                if(__key0_p1!=__row_key0_p1)
+                {
+                    split((__key0_p1) "\\t" (__grp_0_p1), __p2, "\\t");
+                    __p2_nr++;
+                    if((__p2[2] > 10))
+                    {
+                        print(__p2[1],__p2[2]);
+                    }
+                    __key0_p1 = __row_key0_p1;
+                    __grp_0_p1 = 0;
+                }
+            }
+            __grp_0_p1 += __p1[1];
+        }
+    }
+    END{
+        if(__p1_nr!=0 || __print_last_p1==1)
+        {
+            split((__key0_p1) "\\t" (__grp_0_p1), __p2, "\\t");
+            __p2_nr++;
+            if((__p2[2] > 10))
+            {
+                print(__p2[1],__p2[2]);
+            }
+        }
+    }
+    <BLANKLINE>
+    """
+    if not stages:
+        raise Exception('No stages specified')
+    awk, output_desc = _stage_awk(data_desc, stages, 0, None)
+    output_desc.meta = data_desc.meta
+    return awk, output_desc
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,1144 @@
+# coding: utf-8
+"""
+Python backend for tmap_awk/tgrp_awk expressions.
+
+The same RowExpr trees that tabkit.awk turns into awk source are translated
+into python source here. Generated code emulates awk semantics:
+field values are strings, they are converted to numbers by arithmetics,
+comparison of two input values is numeric if both look like numbers,
+numbers are printed as integers if integral and with "%.6g" otherwise.
+"""
+
+import os
+import re
+import sys
+import math
+import time
+from random import Random
+from subprocess import Popen, PIPE
+
+from tabkit.awk_expr import *
+from tabkit.awk_expr import _GrpExprFunc
+from tabkit.awk import filter_map_plan, parse_filter_map
+from tabkit.bloom import load_bloom
+from tabkit.kvstore import KVStore, is_kvstore
+
+##
+## RUNTIME
+##
+
+_RT_INF = float('inf')
+_RT_NUM_PREFIX_RE = re.compile(r'[ \t\n\r\f\v]*[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?')
+_RT_NUM_RE = re.compile(_RT_NUM_PREFIX_RE.pattern + r'[ \t\n\r\f\v]*$')
+
+def _rt_num(value):
+    """
+    Converts value to number like awk does: numeric prefix of a string or 0.
+
+    >>> [_rt_num(val) for val in ['12', ' 1.5e1x', 'abc', '', 3, True]]
+    [12, 15.0, 0, 0, 3, True]
+    """
+    if value.__class__ is str:
+        try:
+            return int(value)
+        except ValueError:
+            match = _RT_NUM_PREFIX_RE.match(value)
+            if match:
+                return float(match.group())
+            return 0
+    return value
+
+def _rt_strnum(value):
+    """
+    Returns numeric value if value is a number or a string that looks like a number, None otherwise.
+
+    >>> [_rt_strnum(val) for val in ['12', ' 1.5 ', '1x', '', 2.5]]
+    [12, 1.5, None, None, 2.5]
+    """
+    if value.__class__ is str:
+        try:
+            return int(value)
+        except ValueError:
+            if _RT_NUM_RE.match(value):
+                return float(value)
+            return None
+    return value
+
+def _rt_str(value, fmt='%.6g'):
+    """
+    fmt is used for non-integer numbers like awk CONVFMT/OFMT.
+
+    >>> [_rt_str(val) for val in ['a', 10, 2.0, 0.1 + 0.2, 1e30, True, -_RT_INF]]
+    ['a', '10', '2', '0.3', '1000000000000000019884624838656', '1', '-inf']
+    >>> _rt_str(0.1 + 0.2, '%.17g')
+    '0.30000000000000004'
+    """
+    cls = value.__class__
+    if cls is str:
+        return value
+    if cls is bool:
+        return '1' if value else '0'
+    if cls is int or cls is long:
+        return str(value)
+    if value != value:
+        return 'nan'
+    if value == _RT_INF or value == -_RT_INF:
+        return '-inf' if value < 0 else 'inf'
+    if value == int(value):
+        return '%d' % (value,)
+    return fmt % (value,)
+
+def _rt_bool(value):
+    """
+    >>> [_rt_bool(val) for val in ['0', '0.0', '', 'a', ' 1', 0, 2]]
+    [False, False, False, True, True, False, True]
+    """
+    if value.__class__ is str:
+        number = _rt_strnum(value)
+        if number is None:
+            return value != ''
+        return number != 0
+    return value != 0
+
+def _rt_cmp(left, right):
+    """
+    awk comparison of values of unknown type.
+
+    >>> _rt_cmp('10', '9'), _rt_cmp('10', 'x'), _rt_cmp('02', 2), _rt_cmp('', 0)
+    (1, -1, 0, -1)
+    """
+    left_num = _rt_strnum(left)
+    if left_num is not None:
+        right_num = _rt_strnum(right)
+        if right_num is not None:
+            return cmp(left_num, right_num)
+    return cmp(_rt_str(left), _rt_str(right))
+
+def _rt_div(left, right):
+    if right == 0:
+        raise Exception('division by zero attempted')
+    return float(left) / right
+
+def _rt_mod(left, right):
+    """
+    >>> _rt_mod(-7, 3), _rt_mod(7.5, 2)
+    (-1.0, 1.5)
+    """
+    if right == 0:
+        raise Exception("division by zero attempted in '%'")
+    return math.fmod(left, right)
+
+def _rt_pow(left, right):
+    try:
+        return float(left) ** right
+    except OverflowError:
+        return _RT_INF
+    except ZeroDivisionError:
+        return _RT_INF
+    except ValueError:
+        return float('nan')
+
+def _rt_int(value):
+    """
+    >>> _rt_int('3.9'), _rt_int(-3.9), _rt_int('x')
+    (3, -3, 0)
+    """
+    value = _rt_num(value)
+    if value.__class__ is float:
+        if value != value or value == _RT_INF or value == -_RT_INF:
+            return value
+    return int(value)
+
+def _rt_round(value):
+    return int(math.floor(value + .5))
+
+def _rt_length(value):
+    return len(_rt_str(value))
+
+def _rt_substr(value, start, length=None):
+    """
+    >>> _rt_substr('hello', 2), _rt_substr('hello', 0, 2), _rt_substr('hello', 2, 3), _rt_substr('hello', 9)
+    ('ello', 'h', 'ell', '')
+    """
+    value = _rt_str(value)
+    start = _rt_round(_rt_num(start))
+    if length is None:
+        end = len(value) + 1
+    else:
+        end = start + _rt_round(_rt_num(length))
+    start = max(start, 1)
+    end = min(end, len(value) + 1)
+    if end <= start:
+        return ''
+    return value[start - 1:end - 1]
+
+def _rt_index(value, substr):
+    return _rt_str(value).find(_rt_str(substr)) + 1
+
+def _rt_tolower(value):
+    return _rt_str(value).lower()
+
+def _rt_toupper(value):
+    return _rt_str(value).upper()
+
+_RT_POSIX_CLASSES = {
+    '[:alpha:]': 'a-zA-Z',
+    '[:digit:]': '0-9',
+    '[:alnum:]': 'a-zA-Z0-9',
+    '[:upper:]': 'A-Z',
+    '[:lower:]': 'a-z',
+    '[:space:]': ' \\t\\n\\r\\f\\v',
+    '[:blank:]': ' \\t',
+    '[:xdigit:]': '0-9A-Fa-f',
+    '[:cntrl:]': '\\x00-\\x1f\\x7f',
+    '[:print:]': '\\x20-\\x7e',
+    '[:graph:]': '\\x21-\\x7e',
+    '[:punct:]': re.escape('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'),
+}
+_RT_REGEX_ESCAPES = {
+    '\\y': '\\b',
+    '\\<': '\\b',
+    '\\>': '\\b',
+    '\\`': '\\A',
+    "\\'": '\\Z',
+}
+_RT_REGEX_CACHE = {}
+
+def _rt_regex(regex):
+    """
+    Compiles awk regular expression (ERE with gawk extensions).
+
+    >>> _rt_regex('^[[:space:]]+|x$').pattern
+    '^[ \\\\t\\\\n\\\\r\\\\f\\\\v]+|x$'
+    """
+    regex = _rt_str(regex)
+    compiled = _RT_REGEX_CACHE.get(regex)
+    if compiled is None:
+        pattern = regex
+        for posix_class, chars in _RT_POSIX_CLASSES.iteritems():
+            pattern = pattern.replace(posix_class, chars)
+        for escape, python_escape in _RT_REGEX_ESCAPES.iteritems():
+            pattern = pattern.replace(escape, python_escape)
+        compiled = _RT_REGEX_CACHE[regex] = re.compile(pattern)
+    return compiled
+
+def _rt_match(value, regex):
+    match = _rt_regex(regex).search(_rt_str(value))
+    if match:
+        return match.start() + 1
+    return 0
+
+_RT_REPL_RE = re.compile(r'\\(\\|&|[0-9])|&')
+
+def _rt_gensub(regex, repl, how, target):
+    """
+    >>> _rt_gensub('^https?://([^/?:#]+).*$', '\\\\1', '', 'http://ya.ru/x')
+    'ya.ru'
+    >>> _rt_gensub('o', '[&]', 'g', 'foo'), _rt_gensub('o', '0', 2, 'foo')
+    ('f[o][o]', 'fo0')
+    """
+    pattern = _rt_regex(regex)
+    repl = _rt_str(repl)
+    target = _rt_str(target)
+
+    def replace(match):
+        def group(token):
+            item = token.group(1)
+            if item is None or item == '0':
+                return match.group(0)
+            elif item in '\\&':
+                return item
+            else:
+                return match.group(int(item)) or ''
+        return _RT_REPL_RE.sub(group, repl)
+
+    if how.__class__ is str and how[:1] in ('g', 'G'):
+        return pattern.sub(replace, target)
+    occurrence = max(int(_rt_num(how)), 1)
+    counter = [0]
+    def replace_nth(match):
+        counter[0] += 1
+        if counter[0] == occurrence:
+            return replace(match)
+        return match.group(0)
+    return pattern.sub(replace_nth, target, occurrence)
+
+def _rt_split(value, sep):
+    """
+    Splits value like awk split() does.
+
+    >>> _rt_split(' a  b ', ' '), _rt_split('a,b,', ','), _rt_split('a1b22c', '[0-9]+'), _rt_split('', ',')
+    (['a', 'b'], ['a', 'b', ''], ['a', 'b', 'c'], [])
+    """
+    value = _rt_str(value)
+    sep = _rt_str(sep)
+    if sep == ' ':
+        return value.split()
+    if value == '':
+        return []
+    if sep == '':
+        return list(value)
+    if len(sep) == 1:
+        return value.split(sep)
+    return _rt_regex(sep).split(value)
+
+def _rt_split_into(array, value, sep):
+    items = _rt_split(value, sep)
+    array[:] = [''] + items
+    return len(items)
+
+def _rt_item(array, idx):
+    idx = _rt_num(idx)
+    if idx == int(idx) and 1 <= idx < len(array):
+        return array[int(idx)]
+    return ''
+
+def _rt_concat(value, items, delim):
+    """
+    Joins items to value with delim, leading empty items are skipped
+    just like awk templates of concat functions do.
+
+    >>> _rt_concat('', ['', 'a', '', 'b'], ','), _rt_concat('x', ['a'], ',')
+    ('a,,b', 'x,a')
+    """
+    items = iter(items)
+    if value == '':
+        for value in items:
+            if value != '':
+                break
+        else:
+            return ''
+    rest = list(items)
+    if rest:
+        return value + delim + delim.join(rest)
+    return value
+
+def _rt_uniq(delim, value):
+    """
+    >>> _rt_uniq(',', 'b,a,b,c')
+    'a,b,c'
+    """
+    delim = _rt_str(delim)
+    return _rt_concat('', sorted(set(_rt_split(value, delim))), delim)
+
+def _rt_median(items):
+    """
+    >>> _rt_median([3, '1', 2]), _rt_median([4, 1, 3, 2]), _rt_median([])
+    (2, 2.5, 0)
+    """
+    def sort_key(value):
+        number = _rt_strnum(value)
+        if number is None:
+            return (1, value)
+        return (0, number)
+    items.sort(key=sort_key)
+    middle, odd = divmod(len(items), 2)
+    if odd:
+        return items[middle]
+    if not items:
+        return 0
+    return _rt_div(_rt_num(items[middle - 1]) + _rt_num(items[middle]), 2)
+
+_RT_FORMAT_RE = re.compile(r'%([-+ #0]*)(\*|[0-9]+)?(?:\.(\*|[0-9]*))?([a-zA-Z%])')
+
+def _rt_sprintf(fmt, *args):
+    """
+    >>> _rt_sprintf('%0.2f|%d|%5s|%c|%x|%%', '1.234', 7.9, 'ab', 65, 255)
+    '1.23|7|   ab|A|ff|%'
+    """
+    fmt = _rt_str(fmt)
+    args = iter(args)
+    def next_arg():
+        for arg in args:
+            return arg
+        raise Exception('not enough arguments to satisfy format string %r' % (fmt,))
+
+    result = []
+    last = 0
+    for match in _RT_FORMAT_RE.finditer(fmt):
+        result.append(fmt[last:match.start()])
+        last = match.end()
+        flags, width, precision, conv = match.groups()
+        if conv == '%':
+            result.append('%')
+            continue
+        if width == '*':
+            width = str(_rt_int(next_arg()))
+        spec = '%' + flags + (width or '')
+        if precision == '*':
+            precision = str(_rt_int(next_arg()))
+        if precision is not None:
+            spec += '.' + precision
+        value = next_arg()
+        if conv in 'diouxX':
+            value = _rt_int(value)
+            if value.__class__ is float:
+                conv = 's'
+                value = _rt_str(value)
+            elif conv in 'iu':
+                conv = 'd'
+        elif conv in 'eEfFgG':
+            value = float(_rt_num(value))
+        elif conv == 'c':
+            conv = 's'
+            if value.__class__ is str:
+                value = value[:1]
+            else:
+                value = chr(_rt_int(value) % 256)
+        elif conv == 's':
+            value = _rt_str(value)
+        else:
+            raise Exception('Unsupported format specifier %r in %r' % (match.group(), fmt))
+        result.append((spec + conv) % (value,))
+    result.append(fmt[last:])
+    return ''.join(result)
+
+def _rt_mktime(spec):
+    """
+    >>> _rt_mktime('2014 01 02 03 04 05') == time.mktime((2014, 1, 2, 3, 4, 5, 0, 0, -1))
+    True
+    >>> _rt_mktime('bad')
+    -1
+    """
+    parts = _rt_str(spec).split()
+    if len(parts) < 6:
+        return -1
+    try:
+        parts = [int(part) for part in parts[:7]]
+        dst = parts[6] if len(parts) > 6 else -1
+        return int(time.mktime(tuple(parts[:6]) + (0, 0, dst)))
+    except (ValueError, OverflowError):
+        return -1
+
+def _rt_strftime(fmt='%a %b %e %H:%M:%S %Z %Y', timestamp=None, utc=0):
+    if timestamp is None:
+        timestamp = time.time()
+    convert = time.gmtime if _rt_bool(utc) else time.localtime
+    return time.strftime(_rt_str(fmt), convert(_rt_num(timestamp)))
+
+def _rt_systime():
+    return int(time.time())
+
+def _rt_log(value):
+    value = _rt_num(value)
+    if value < 0:
+        return float('nan')
+    if value == 0:
+        return -_RT_INF
+    return math.log(value)
+
+def _rt_exp(value):
+    try:
+        return math.exp(_rt_num(value))
+    except OverflowError:
+        return _RT_INF
+
+def _rt_sqrt(value):
+    value = _rt_num(value)
+    if value < 0:
+        return float('nan')
+    return math.sqrt(value)
+
+def _rt_sin(value):
+    return math.sin(_rt_num(value))
+
+def _rt_cos(value):
+    return math.cos(_rt_num(value))
+
+def _rt_atan2(y, x):
+    return math.atan2(_rt_num(y), _rt_num(x))
+
+_RT_RANDOM = Random(0)
+
+def _rt_rand():
+    return _RT_RANDOM.random()
+
+def _rt_srand(seed=None):
+    _RT_RANDOM.seed(_rt_systime() if seed is None else _rt_num(seed))
+    return 0
+
+_RT_BITWISE_MAX = 9007199254740991
+
+def _rt_check_bitwise(func_name, *values):
+    for value in values:
+        if value > _RT_BITWISE_MAX:
+            raise Exception("arg for bitwise operation %s is gt 2**53 - 1" % (func_name,))
+
+def _rt_and(left, right):
+    return int(_rt_num(left)) & int(_rt_num(right))
+
+def _rt_or(left, right):
+    return int(_rt_num(left)) | int(_rt_num(right))
+
+def _rt_xor(left, right):
+    return int(_rt_num(left)) ^ int(_rt_num(right))
+
+def _rt_lshift(left, right):
+    return int(_rt_num(left)) << int(_rt_num(right))
+
+def _rt_rshift(left, right):
+    return int(_rt_num(left)) >> int(_rt_num(right))
+
+def _rt_compl(value):
+    return ~int(_rt_num(value)) & _RT_BITWISE_MAX
+
+def _rt_safe_bitwise(func_name, func):
+    def safe_bitwise(*values):
+        _rt_check_bitwise(func_name, *[_rt_num(value) for value in values])
+        return func(*values)
+    return safe_bitwise
+
+def _rt_make_crc32_table():
+    table = []
+    for idx in xrange(256):
+        crc = idx << 24
+        for bit in xrange(8):
+            if crc & 0x80000000:
+                crc = ((crc << 1) ^ 0x04C11DB7) & 0xffffffff
+            else:
+                crc = (crc << 1) & 0xffffffff
+        table.append(crc)
+    return table
+
+_RT_CRC32_TABLE = _rt_make_crc32_table()
+
+def _rt_crc32(value):
+    """
+    Same checksum as crc32() awk function and POSIX cksum.
+
+    >>> _rt_crc32('abc'), _rt_crc32('')
+    (1219131554, 4294967295)
+    """
+    table = _RT_CRC32_TABLE
+    value = _rt_str(value)
+    crc = 0
+    for char in value:
+        crc = ((crc << 8) & 0xffffffff) ^ table[((crc >> 24) ^ ord(char)) & 0xff]
+    length = len(value)
+    while length:
+        crc = ((crc << 8) & 0xffffffff) ^ table[((crc >> 24) ^ length) & 0xff]
+        length >>= 8
+    return ~crc & 0xffffffff
+
+_RT_FILE_MAPS = {}
+_RT_FILE_SETS = {}
+
+def _rt_open_table(fname):
+    if not os.path.exists(fname):
+        raise Exception('%s not found' % (fname,))
+    return open(fname)
+
+def _rt_map_from_file(fname, key, default):
+    fname = _rt_str(fname)
+    table = _RT_FILE_MAPS.get(fname)
+    if table is None:
+        fobj = _rt_open_table(fname)
+        if is_kvstore(fname): # compiled by tdict build, looked up in place
+            fobj.close()
+            table = _RT_FILE_MAPS[fname] = KVStore(fname)
+        else:
+            table = _RT_FILE_MAPS[fname] = {}
+            for line in fobj:
+                fields = line.rstrip('\n').split('\t', 2)
+                table[fields[0]] = fields[1] if len(fields) > 1 else ''
+    return table.get(_rt_str(key), default)
+
+def _rt_is_in_file(fname, key):
+    fname = _rt_str(fname)
+    table = _RT_FILE_SETS.get(fname)
+    if table is None:
+        table = _RT_FILE_SETS[fname] = set(
+            line.rstrip('\n') for line in _rt_open_table(fname)
+        )
+    return _rt_str(key) in table
+
+_RT_BLOOMS = {}
+
+def _rt_in_bloom(fname, key):
+    fname = _rt_str(fname)
+    bloom = _RT_BLOOMS.get(fname)
+    if bloom is None:
+        if not os.path.exists(fname):
+            raise Exception('%s not found' % (fname,))
+        bloom = _RT_BLOOMS[fname] = load_bloom(fname)
+    return _rt_str(key) in bloom
+
+_RT_CMD_PIPES = {}
+
+def _rt_getline_cmd(cmd, value):
+    """
+    cmd | getline var: returns the next line of cmd output or value on EOF.
+    """
+    cmd = _rt_str(cmd)
+    pipe = _RT_CMD_PIPES.get(cmd)
+    if pipe is None:
+        pipe = _RT_CMD_PIPES[cmd] = Popen(cmd, shell=True, stdout=PIPE)
+    line = pipe.stdout.readline()
+    if not line:
+        return value
+    if line.endswith('\n'):
+        line = line[:-1]
+    return line
+
+def _rt_getline_cmd_status(cmd):
+    """
+    var = (cmd | getline var): the line read is replaced with getline status.
+    """
+    marker = []
+    return 0 if _rt_getline_cmd(cmd, marker) is marker else 1
+
+PY_RUNTIME = dict(
+    (name, value) for name, value in globals().items()
+    if name.startswith('_rt_') or name.startswith('_RT_')
+)
+
+##
+## CODE GENERATION
+##
+
+def awk_str_value(const):
+    r"""
+    Value of awk string literal with const inside the quotes.
+
+    >>> awk_str_value(r'a\\1\"\tb\.')
+    'a\\1"\tb.'
+    """
+    def unescape(match):
+        char = match.group(1)
+        if char in _AWK_STR_ESCAPES:
+            return _AWK_STR_ESCAPES[char]
+        if char[0] in '01234567':
+            return chr(int(char, 8) % 256)
+        return char
+    return _AWK_STR_ESCAPE_RE.sub(unescape, const)
+
+_AWK_STR_ESCAPE_RE = re.compile(r'\\([0-7]{1,3}|.)', re.S)
+_AWK_STR_ESCAPES = {
+    'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a', 'b': '\b',
+}
+
+# function name: (runtime function, result kind)
+PY_FUNCS = {
+    'int'         : ('_rt_int', 'num'),
+    'length'      : ('_rt_length', 'num'),
+    'substr'      : ('_rt_substr', 'str'),
+    'index'       : ('_rt_index', 'num'),
+    'match'       : ('_rt_match', 'num'),
+    'tolower'     : ('_rt_tolower', 'str'),
+    'toupper'     : ('_rt_toupper', 'str'),
+    'sprintf'     : ('_rt_sprintf', 'str'),
+    'gensub'      : ('_rt_gensub', 'str'),
+    'mktime'      : ('_rt_mktime', 'num'),
+    'strftime'    : ('_rt_strftime', 'str'),
+    'systime'     : ('_rt_systime', 'num'),
+    'log'         : ('_rt_log', 'num'),
+    'exp'         : ('_rt_exp', 'num'),
+    'sqrt'        : ('_rt_sqrt', 'num'),
+    'sin'         : ('_rt_sin', 'num'),
+    'cos'         : ('_rt_cos', 'num'),
+    'atan2'       : ('_rt_atan2', 'num'),
+    'rand'        : ('_rt_rand', 'num'),
+    'srand'       : ('_rt_srand', 'num'),
+    'and'         : ('_rt_and', 'num'),
+    'or'          : ('_rt_or', 'num'),
+    'xor'         : ('_rt_xor', 'num'),
+    'lshift'      : ('_rt_lshift', 'num'),
+    'rshift'      : ('_rt_rshift', 'num'),
+    'compl'       : ('_rt_compl', 'num'),
+    'and_safe'    : ('_rt_and_safe', 'num'),
+    'or_safe'     : ('_rt_or_safe', 'num'),
+    'lshift_safe' : ('_rt_lshift_safe', 'num'),
+    'rshift_safe' : ('_rt_rshift_safe', 'num'),
+    'compl_safe'  : ('_rt_compl_safe', 'num'),
+    'crc32'       : ('_rt_crc32', 'num'),
+    'uniq'        : ('_rt_uniq', 'str'),
+    'map_from_file' : ('_rt_map_from_file', 'mixed'),
+    'is_in_file'  : ('_rt_is_in_file', 'bool'),
+    'in_bloom'    : ('_rt_in_bloom', 'bool'),
+}
+
+PY_RUNTIME.update(
+    _rt_and_safe = _rt_safe_bitwise('and', _rt_and),
+    _rt_or_safe = _rt_safe_bitwise('or', _rt_or),
+    _rt_lshift_safe = _rt_safe_bitwise('lshift', _rt_lshift),
+    _rt_rshift_safe = _rt_safe_bitwise('rshift', _rt_rshift),
+    _rt_compl_safe = _rt_safe_bitwise('compl', _rt_compl),
+)
+
+NUMERIC_KINDS = ('num', 'bool')
+STRING_KINDS = ('str', 'strnum')
+
+class PyExprCompiler(object):
+    """
+    Translates RowExpr trees into python expressions.
+
+    Every expression has a kind: 'num' and 'bool' are numbers,
+    'str' are strings, 'strnum' are strings that came from input
+    (compared as numbers if look like numbers) and 'mixed' is
+    anything of the above.
+
+    grp_funcs maps grouping function names to dicts with 'kind' key:
+    'num', 'str', 'mixed' or 'argN' (the kind of N-th argument).
+
+    emit is 'write' (output lines are passed to write callback)
+    or 'yield' (generated function is a generator of output lines).
+
+    ofmt, if set, is the format of printed non-integer numbers (awk OFMT).
+    """
+    def __init__(self, grp_funcs=None, emit='write'):
+        if emit not in ('write', 'yield'):
+            raise Exception('Unknown emit mode %r' % (emit,))
+        self.grp_funcs = grp_funcs or {}
+        self.emit = emit
+        self.ofmt = None
+        self.var_kinds = {}
+        self.varnames = set()
+        self.arrays = set()
+        self.fields = set()
+        self.uses_nf = False
+        self.uses_line = False
+
+    def var(self, name):
+        varname = 'v_' + name
+        self.varnames.add(varname)
+        return varname
+
+    def array(self, name):
+        arrname = 'a_' + name
+        self.arrays.add(arrname)
+        return arrname
+
+    def kind(self, node):
+        if isinstance(node, RowExprConst):
+            return 'str' if node.type == 'str' else 'num'
+        elif isinstance(node, RowExprField):
+            return 'strnum'
+        elif isinstance(node, RowExprBuiltinVar):
+            return 'num' if node.name in ('NR', 'NF') else 'strnum'
+        elif isinstance(node, _GrpExprFunc):
+            kind = self.grp_funcs[node.func]['kind']
+            if kind.startswith('arg'):
+                return self.kind(node.args[int(kind[3:])])
+            return kind
+        elif isinstance(node, RowExprVar):
+            if node.name not in self.var_kinds:
+                assign_expr = node.ctx.get_var_assign_expr(node.name)
+                if isinstance(assign_expr, RowExprAssign):
+                    self.var_kinds[node.name] = self.kind(assign_expr.value)
+                else: # cmd | getline var
+                    self.var_kinds[node.name] = 'strnum'
+            return self.var_kinds[node.name]
+        elif isinstance(node, (RowExprSideEffectVar, RowExprSubscript)):
+            return 'strnum'
+        elif isinstance(node, RowExprFunc):
+            if node.func == '-':
+                return 'num'
+            elif node.func == '!':
+                return 'bool'
+            elif node.func == 'split':
+                return 'num'
+            elif node.func in PY_FUNCS:
+                return PY_FUNCS[node.func][1]
+            else:
+                return 'mixed'
+        elif isinstance(node, RowExprOp):
+            if node.op == '':
+                return 'str'
+            elif node.op in ('&&', '||', '==', '!=', '>', '<', '>=', '<='):
+                return 'bool'
+            else:
+                return 'num'
+        elif isinstance(node, RowExprIf):
+            body_kind = self.kind(node.body)
+            orelse_kind = self.kind(node.orelse)
+            if body_kind == orelse_kind:
+                return body_kind
+            elif body_kind in NUMERIC_KINDS and orelse_kind in NUMERIC_KINDS:
+                return 'num'
+            else:
+                return 'mixed'
+        else:
+            raise Exception('Unsupported node %r' % (node,))
+
+    def is_numeric(self, node):
+        return self.kind(node) in NUMERIC_KINDS
+
+    def num(self, node):
+        if isinstance(node, RowExprConst):
+            if node.type == 'str':
+                return repr(PY_RUNTIME['_rt_num'](awk_str_value(node.const)))
+            return repr(node.const)
+        elif self.is_numeric(node):
+            return self.expr(node)
+        else:
+            return '_rt_num(%s)' % (self.expr(node),)
+
+    def str(self, node):
+        return self.as_str(self.expr(node), self.kind(node))
+
+    def as_str(self, code, kind):
+        if kind in STRING_KINDS:
+            return code
+        else:
+            return '_rt_str(%s)' % (code,)
+
+    def bool(self, node):
+        kind = self.kind(node)
+        code = self.expr(node)
+        if kind == 'bool':
+            return code
+        elif kind == 'num':
+            return '(%s != 0)' % (code,)
+        elif kind == 'str':
+            return "(%s != '')" % (code,)
+        else:
+            return '_rt_bool(%s)' % (code,)
+
+    def compare(self, op, left_code, left_kind, right_code, right_kind):
+        if left_kind in NUMERIC_KINDS and right_kind in NUMERIC_KINDS:
+            return '(%s %s %s)' % (left_code, op, right_code)
+        elif left_kind == 'str' or right_kind == 'str':
+            return '(%s %s %s)' % (
+                self.as_str(left_code, left_kind), op, self.as_str(right_code, right_kind)
+            )
+        else:
+            return '(_rt_cmp(%s, %s) %s 0)' % (left_code, right_code, op)
+
+    def expr(self, node):
+        if isinstance(node, RowExprConst):
+            if node.type == 'str':
+                return repr(awk_str_value(node.const))
+            return repr(node.const)
+        elif isinstance(node, RowExprField):
+            idx = node.ctx.data_desc.field_index(node.name)
+            self.fields.add(idx)
+            return 'f[%d]' % (idx,)
+        elif isinstance(node, RowExprBuiltinVar):
+            if node.name == 'NR':
+                return 'nr'
+            elif node.name == 'NF':
+                self.uses_nf = True
+                return 'nf'
+            else:
+                raise Exception('%r is not supported by the python engine' % (node.name,))
+        elif isinstance(node, _GrpExprFunc):
+            return self.var(node.name)
+        elif isinstance(node, RowExprVar):
+            return self.var(node.name)
+        elif isinstance(node, RowExprSideEffectVar):
+            if isinstance(node.var, RowExprVar) and node.var.name == node.name:
+                return self.var(node.name)
+            return self.array(node.name)
+        elif isinstance(node, RowExprSubscript):
+            return '_rt_item(%s, %s)' % (self.expr(node.var), self.num(node.idx))
+        elif isinstance(node, RowExprFunc):
+            return self.func(node)
+        elif isinstance(node, RowExprOp):
+            return self.op(node)
+        elif isinstance(node, RowExprIf):
+            return '(%s if %s else %s)' % (
+                self.expr(node.body), self.bool(node.test), self.expr(node.orelse),
+            )
+        else:
+            raise Exception('Unsupported node %r' % (node,))
+
+    def func(self, node):
+        if node.func == '-':
+            return '(-%s)' % (self.num(node.args[0]),)
+        elif node.func == '!':
+            return '(not %s)' % (self.bool(node.args[0]),)
+        elif node.func == 'split':
+            value, array, sep = node.args
+            return '_rt_split_into(%s, %s, %s)' % (
+                self.array(array.name), self.expr(value), self.expr(sep),
+            )
+        elif node.func == 'length' and not node.args:
+            self.uses_line = True
+            return 'len(l)'
+        elif node.func in PY_FUNCS:
+            return '%s(%s)' % (
+                PY_FUNCS[node.func][0],
+                ', '.join(self.expr(arg) for arg in node.args),
+            )
+        else:
+            raise Exception('Function %r is not supported by the python engine' % (node.func,))
+
+    def op(self, node):
+        if node.op in ('+', '-', '*'):
+            return '(' + (' %s ' % (node.op,)).join(self.num(arg) for arg in node.args) + ')'
+        elif node.op in ('/', '%', '^'):
+            func = {'/': '_rt_div', '%': '_rt_mod', '^': '_rt_pow'}[node.op]
+            code = self.num(node.args[0])
+            for arg in node.args[1:]:
+                code = '%s(%s, %s)' % (func, code, self.num(arg))
+            return code
+        elif node.op in ('&&', '||'):
+            py_op = ' and ' if node.op == '&&' else ' or '
+            return '(' + py_op.join(self.bool(arg) for arg in node.args) + ')'
+        elif node.op in ('==', '!=', '>', '<', '>=', '<='):
+            left, right = node.args
+            return self.compare(
+                node.op,
+                self.expr(left), self.kind(left),
+                self.expr(right), self.kind(right),
+            )
+        elif node.op == '':
+            args = [
+                arg for arg in node.args
+                if not (isinstance(arg, RowExprConst) and arg.const == '')
+            ]
+            if not args:
+                return "''"
+            return '(' + ' + '.join(self.str(arg) for arg in args) + ')'
+        else:
+            raise Exception('Operator %r is not supported by the python engine' % (node.op,))
+
+    def statement(self, assign_expr, nested=False):
+        if isinstance(assign_expr, RowExprAssign):
+            return '%s = %s' % (self.var(assign_expr.target), self.expr(assign_expr.value))
+        elif isinstance(assign_expr, RowExprOp) and assign_expr.op == ' ':
+            varname = self.var(assign_expr.args[3].name)
+            if nested:
+                # var = (cmd | getline var), see RowExprVar.pop_nested
+                return '%s = _rt_getline_cmd_status(%s)' % (
+                    varname, self.expr(assign_expr.args[0]),
+                )
+            else:
+                # cmd | getline var
+                return '%s = _rt_getline_cmd(%s, %s)' % (
+                    varname, self.expr(assign_expr.args[0]), varname,
+                )
+        else:
+            raise Exception('Unsupported statement %r' % (assign_expr,))
+
+    def nested_statements(self, exprs):
+        """
+        Assignments of the context variables the exprs depend on,
+        dependencies go first (python analogue of pop_nested).
+        """
+        nested = []
+        for expr in exprs:
+            for node in expr.find(RowExprVar, {}):
+                if not isinstance(node, _GrpExprFunc) and node.ctx.has_var(node.name):
+                    nested.append(node)
+        statements = []
+        seen = set()
+        for node in reversed(nested):
+            if node.name not in seen:
+                seen.add(node.name)
+                statements.append(self.statement(node.ctx.get_var_assign_expr(node.name), nested=True))
+        return statements
+
+    def out_str(self, node):
+        kind = self.kind(node)
+        if self.ofmt and kind not in STRING_KINDS:
+            return '_rt_str(%s, %r)' % (self.expr(node), self.ofmt)
+        return self.as_str(self.expr(node), kind)
+
+    def print_statement(self, exprs):
+        if not exprs:
+            self.uses_line = True
+            value = "l + '\\n'"
+        elif len(exprs) == 1:
+            value = "%s + '\\n'" % (self.out_str(exprs[0]),)
+        else:
+            value = '%r %% (%s)' % (
+                '\t'.join(['%s'] * len(exprs)) + '\n',
+                ', '.join(self.out_str(expr) for expr in exprs),
+            )
+        if self.emit == 'yield':
+            return 'yield ' + value
+        else:
+            return 'write(%s)' % (value,)
+
+def add_py_blocks(block1, block2):
+    if isinstance(block1, PyBlock):
+        block1 = block1.lines
+    elif isinstance(block1, PyHeadBlock):
+        block1 = [block1]
+    if isinstance(block2, PyBlock):
+        block2 = block2.lines
+    elif isinstance(block2, PyHeadBlock):
+        block2 = [block2]
+    return PyBlock(block1 + block2)
+
+class PyBlock(object):
+    """
+    >>> block = PyBlock(['a = 1', PyHeadBlock('if a', PyBlock(['b = 2\\nc = 3'])), PyHeadBlock('else', PyBlock())])
+    >>> print '\\n'.join(block.tolines())
+    a = 1
+    if a:
+        b = 2
+        c = 3
+    else:
+        pass
+    """
+    def __init__(self, lines=None):
+        self.lines = lines or []
+    def __nonzero__(self):
+        return bool(self.lines)
+    def append(self, line):
+        self.lines.append(line)
+    def extend(self, lines):
+        self.lines.extend(lines)
+    def __add__(self, block):
+        return add_py_blocks(self, block)
+    def __radd__(self, block):
+        return add_py_blocks(block, self)
+    def tolines(self, ident=4, level=0):
+        lines = []
+        for line in self.lines:
+            if isinstance(line, (PyBlock, PyHeadBlock)):
+                lines.extend(line.tolines(ident, level))
+            elif line:
+                lines.extend(' '*ident*level + part for part in line.split('\n'))
+        return lines
+
+class PyHeadBlock(object):
+    def __init__(self, header_str, block):
+        self.header_str = header_str
+        self.block = block
+    def __add__(self, block):
+        return add_py_blocks(self, block)
+    def __radd__(self, block):
+        return add_py_blocks(block, self)
+    def tolines(self, ident=4, level=0):
+        return (
+            [' '*ident*level + self.header_str + ':']
+            + (self.block.tolines(ident, level+1) or [' '*ident*(level+1) + 'pass'])
+        )
+
+class PyScript(object):
+    """
+    Python analogue of AwkScript: compiles to main(lines, write) function
+    that runs begin, main for every input line and end blocks.
+
+    >>> script = PyScript(
+    ...     begin = PyBlock(['v_s = 0']),
+    ...     main = PyBlock(['v_s += 1']),
+    ...     end = PyBlock(["write('%d\\\\n' % (v_s,))"]),
+    ...     compiler = PyExprCompiler(),
+    ... )
+    >>> print script.tostr()
+    def main(lines, write):
+        v_s = 0
+        nr = 0
+        for line in lines:
+            nr += 1
+            v_s += 1
+        write('%d\\n' % (v_s,))
+    <BLANKLINE>
+    >>> import sys
+    >>> script.run(['a\\n', 'b\\n'], sys.stdout)
+    2
+
+    Scripts compiled with emit='yield' are generators of output lines
+    and can be chained without pipes:
+
+    >>> from tabkit.header import parse_header
+    >>> script1, desc1 = py_filter_map(parse_header('# a b'), ['a>1'], ['c=a+b'], emit='yield')
+    >>> script2, desc2 = py_filter_map(desc1, [], ['d=c*2; c'], emit='yield')
+    >>> print desc2
+    DataDesc([DataField('d', 'any'), DataField('c', 'any')])
+    >>> list(script2.iterlines(script1.iterlines(['1\\t2\\n', '2\\t3\\n'])))
+    ['10\\t5\\n']
+    """
+    def __init__(self, main, begin=None, end=None, compiler=None):
+        self.main = main
+        self.begin = begin or PyBlock([])
+        self.end = end or PyBlock([])
+        self.compiler = compiler or PyExprCompiler()
+    def tostr(self, ident=4):
+        # generate blocks first, compiler collects used names meanwhile
+        begin = self.begin.tolines(ident, 1)
+        main = self.main.tolines(ident, 2)
+        end = self.end.tolines(ident, 1)
+
+        compiler = self.compiler
+        if compiler.emit == 'yield':
+            lines = ['def main(lines):']
+        else:
+            lines = ['def main(lines, write):']
+        for varname in sorted(compiler.varnames):
+            lines.append(' '*ident + "%s = ''" % (varname,))
+        for arrname in sorted(compiler.arrays):
+            lines.append(' '*ident + "%s = []" % (arrname,))
+        lines.extend(begin)
+        lines.append(' '*ident + 'nr = 0')
+        lines.append(' '*ident + 'for line in lines:')
+        split = ['nr += 1']
+        if compiler.fields or compiler.uses_nf or compiler.uses_line:
+            split.append("l = line.rstrip('\\n')")
+        if compiler.fields:
+            max_idx = max(compiler.fields)
+            if max_idx:
+                split.append("f = (l + %r).split('\\t', %d)" % ('\t' * max_idx, max_idx + 1))
+            else:
+                split.append("f = l.split('\\t', 1)")
+        if compiler.uses_nf:
+            split.append("nf = l.count('\\t') + 1 if l else 0")
+        lines.extend(' '*ident*2 + line for line in split)
+        lines.extend(main)
+        lines.extend(end)
+        return '\n'.join(lines) + '\n'
+    def compile(self):
+        namespace = dict(PY_RUNTIME)
+        exec compile(self.tostr(), '<tabkit python engine>', 'exec') in namespace
+        return namespace['main']
+    def run(self, lines, out=None):
+        out = out or sys.stdout
+        if self.compiler.emit == 'yield':
+            out.writelines(self.compile()(lines))
+        else:
+            self.compile()(lines, out.write)
+    def iterlines(self, lines):
+        if self.compiler.emit != 'yield':
+            raise Exception("iterlines needs script compiled with emit='yield'")
+        return self.compile()(lines)
+
+def py_filter_map_from_context(compiler, ctx, filter_expr=None, order=None, already_assigned=None):
+    assign_before_if, assign_after_if, output_exprs, output_desc = filter_map_plan(
+        ctx, filter_expr, order, already_assigned
+    )
+
+    block = PyBlock([compiler.print_statement(output_exprs)])
+    if assign_after_if:
+        block = PyBlock([compiler.statement(expr) for expr in assign_after_if]) + block
+    if filter_expr:
+        block = PyBlock([PyHeadBlock('if %s' % (compiler.bool(filter_expr),), block)])
+    if assign_before_if:
+        block = PyBlock([compiler.statement(expr) for expr in assign_before_if]) + block
+
+    return block, output_desc
+
+def py_filter_map(data_desc, filter_strs, map_strs, emit='write'):
+    """
+    Same as awk_filter_map, but returns PyScript running in-process.
+
+    >>> from tabkit.header import parse_header
+    >>> script, desc = py_filter_map(
+    ...     parse_header('# d p e s c m'),
+    ...     ['e==157 and (s>100 or s in [15,30,45])'],
+    ...     ['ctr=c/s', 'cpm=ctr*m']
+    ... )
+    >>> print desc
+    DataDesc([DataField('ctr', 'any'), DataField('cpm', 'any')])
+    >>> from StringIO import StringIO
+    >>> out = StringIO()
+    >>> script.run(['1\\t2\\t157\\t200\\t10\\t4\\n', '1\\t2\\t157\\t20\\t10\\t4\\n', '1\\t2\\t157\\t15\\t3\\t4\\n'], out)
+    >>> out.getvalue()
+    '0.05\\t0.2\\n0.2\\t0.8\\n'
+    """
+    ctx, filter_expr = parse_filter_map(data_desc, filter_strs, map_strs)
+    compiler = PyExprCompiler(emit=emit)
+    block, output_desc = py_filter_map_from_context(compiler, ctx, filter_expr, data_desc.order)
+    if output_desc:
+        output_desc.meta = data_desc.meta
+    return PyScript(block, compiler=compiler), output_desc or data_desc
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -15,7 +15,7 @@ def infer_type(obj):
                 return infer_type(obj.args[1])
             if obj.func in ["first", "last"]:
                 return infer_type(obj.args[0])
-            if obj.func in ["max", "min", "sum", "product", "median", "var"]:
+            if obj.func in ["max", "min", "sum", "product", "median", "chain_median", "var"]:
                 type = infer_type(obj.args[0])
                 if type not in ['int', 'float']:
                     type = 'float'
@@ -27,6 +27,7 @@ def infer_type(obj):
             if obj.func in [
                     "concat", "concat_uniq", "concat_sorted",
                     "chain_concat_uniq", "concat_sample",
+                    "chain_concat_sorted", "chain_concat_sample",
                 ]:
                 return "str"
         else:
@@ -0,0 +1,195 @@
+# coding: utf-8
+"""
+Block gzip files: data compressed by independent gzip members of about
+BLOCK_SIZE bytes of whole lines, followed by an index of the blocks.
+
+The file is a valid multi-member gzip stream (gzip -cd prints its data),
+the index is kept in extra fields (RFC 1952 FEXTRA) of empty members:
+members with subfield "TI" hold (offset in file, offset in data) of every
+block as little-endian uint64 pairs, the last member of fixed size with
+subfield "TT" holds offset of the first index member and number of blocks.
+Blocks can be read from any place and decompressed independently.
+"""
+
+import os
+import zlib
+import struct
+from multiprocessing.pool import ThreadPool
+
+BLOCK_SIZE = 1 << 20
+
+_ENTRY = struct.Struct('<QQ')
+_SUBFIELD = struct.Struct('<2sH')
+_GZIP_HEAD = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' # deflate, FEXTRA, unknown OS
+_EMPTY_DEFLATE = '\x03\x00'
+_GZIP_TAIL = '\x00' * 8 # crc32 and size of empty data
+_MAX_ENTRIES = (0xffff - _SUBFIELD.size) // _ENTRY.size
+_TAIL_SIZE = len(_GZIP_HEAD) + 2 + _SUBFIELD.size + _ENTRY.size + len(_EMPTY_DEFLATE) + len(_GZIP_TAIL)
+
+def _empty_member(subfield_id, payload):
+    extra = _SUBFIELD.pack(subfield_id, len(payload)) + payload
+    return _GZIP_HEAD + struct.pack('<H', len(extra)) + extra + _EMPTY_DEFLATE + _GZIP_TAIL
+
+def _member_extra(data, subfield_id):
+    """
+    Payload of subfield_id in extra field of empty member data.
+    """
+    if not data.startswith(_GZIP_HEAD):
+        return None
+    xlen, = struct.unpack_from('<H', data, len(_GZIP_HEAD))
+    pos = len(_GZIP_HEAD) + 2
+    extra_end = pos + xlen
+    while pos + _SUBFIELD.size <= extra_end:
+        sub_id, size = _SUBFIELD.unpack_from(data, pos)
+        pos += _SUBFIELD.size
+        if sub_id == subfield_id:
+            return data[pos:pos + size]
+        pos += size
+    return None
+
+def _compress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def write_block_gzip(lines, fobj, header=None, block_size=BLOCK_SIZE, level=6):
+    """
+    Writes lines compressed by blocks, header is written as a separate
+    block. Returns number of blocks.
+
+    >>> import tempfile, gzip
+    >>> fname = tempfile.mktemp()
+    >>> with open(fname, 'wb') as fobj:
+    ...     write_block_gzip(['%d\\n' % num for num in range(1000)], fobj, '# a\\n', 1000)
+    5
+    >>> is_block_gzip(fname), gzip.open(fname).read() == '# a\\n' + ''.join('%d\\n' % num for num in range(1000))
+    (True, True)
+    >>> index = read_block_index(fname)
+    >>> [data_pos for pos, data_pos in index]
+    [0, 4, 1006, 2006, 3006, 3894]
+    >>> ''.join(read_blocks(fname, index[2:4])) == ''.join('%d\\n' % num for num in range(278, 528))
+    True
+    """
+    entries = []
+    pos = [0, 0]
+    def write_block(data):
+        entries.append(tuple(pos))
+        member = _compress(data, level)
+        fobj.write(member)
+        pos[0] += len(member)
+        pos[1] += len(data)
+
+    if header:
+        write_block(header)
+    buf = []
+    buf_size = 0
+    for line in lines:
+        buf.append(line)
+        buf_size += len(line)
+        if buf_size >= block_size:
+            write_block(''.join(buf))
+            buf = []
+            buf_size = 0
+    if buf:
+        write_block(''.join(buf))
+
+    index_pos = pos[0]
+    entries.append(tuple(pos))
+    for start in xrange(0, len(entries), _MAX_ENTRIES):
+        fobj.write(_empty_member('TI', ''.join(
+            _ENTRY.pack(*entry) for entry in entries[start:start + _MAX_ENTRIES]
+        )))
+    fobj.write(_empty_member('TT', _ENTRY.pack(index_pos, len(entries) - 1)))
+    return len(entries) - 1
+
+def _read_tail(fobj):
+    fobj.seek(0, os.SEEK_END)
+    if fobj.tell() < _TAIL_SIZE:
+        return None
+    fobj.seek(-_TAIL_SIZE, os.SEEK_END)
+    payload = _member_extra(fobj.read(_TAIL_SIZE), 'TT')
+    if payload is None or len(payload) != _ENTRY.size:
+        return None
+    return _ENTRY.unpack(payload)
+
+def is_block_gzip(fname):
+    with open(fname, 'rb') as fobj:
+        return _read_tail(fobj) is not None
+
+def read_block_index(fname):
+    """
+    List of (offset in file, offset in data) of blocks
+    and of the end of data.
+    """
+    with open(fname, 'rb') as fobj:
+        tail = _read_tail(fobj)
+        if tail is None:
+            raise Exception('%r is not a block gzip file' % (fname,))
+        index_pos, count = tail
+        fobj.seek(index_pos)
+        entries = []
+        while len(entries) <= count:
+            head = fobj.read(len(_GZIP_HEAD) + 2)
+            if len(head) != len(_GZIP_HEAD) + 2:
+                raise Exception('Block gzip file %r is truncated' % (fname,))
+            xlen, = struct.unpack_from('<H', head, len(_GZIP_HEAD))
+            member = head + fobj.read(xlen + len(_EMPTY_DEFLATE) + len(_GZIP_TAIL))
+            payload = _member_extra(member, 'TI')
+            if payload is None:
+                raise Exception('Bad index of block gzip file %r' % (fname,))
+            entries.extend(
+                _ENTRY.unpack_from(payload, pos)
+                for pos in xrange(0, len(payload), _ENTRY.size)
+            )
+    return entries[:count + 1]
+
+def block_groups(index, first, parts):
+    """
+    Splits blocks from first one into up to parts groups of
+    about the same compressed size, returns (first, last + 1)
+    block numbers of groups.
+
+    >>> block_groups([(0, 0), (10, 4), (20, 8), (30, 12), (40, 16)], 1, 2)
+    [(1, 3), (3, 4)]
+    >>> block_groups([(0, 0), (10, 4)], 1, 2)
+    []
+    """
+    count = len(index) - 1
+    if first >= count:
+        return []
+    start, end = index[first][0], index[count][0]
+    bounds = [first]
+    for num in xrange(first + 1, count):
+        if index[num][0] - start >= (end - start) * len(bounds) // parts:
+            bounds.append(num)
+    bounds.append(count)
+    return zip(bounds, bounds[1:])
+
+def read_blocks(fname, index, threads=None, ahead=None):
+    """
+    Data of blocks from index entries (the last entry is used
+    as the end), decompressed by threads with up to ahead
+    blocks decompressed ahead of the reader.
+    """
+    threads = threads or 1
+    ahead = ahead or 2 * threads
+    pool = ThreadPool(threads)
+    try:
+        with open(fname, 'rb') as fobj:
+            fobj.seek(index[0][0])
+            pending = []
+            for (pos, data_pos), (next_pos, next_data_pos) in zip(index, index[1:]):
+                member = fobj.read(next_pos - pos)
+                pending.append(pool.apply_async(zlib.decompress, (member, 16 + zlib.MAX_WBITS)))
+                if len(pending) > ahead:
+                    yield pending.pop(0).get()
+            for result in pending:
+                yield result.get()
+    finally:
+        pool.terminate()
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
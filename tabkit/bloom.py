@@ -0,0 +1,100 @@
+# coding: utf-8
+"""
+Bloom filters of key sets stored in files.
+
+File format: text line "TBLOOM1<tab>bits<tab>hashes<tab>keys" followed
+by the bit array. Key positions are taken by double hashing of the md5
+digest, so filters built by one process are valid in any other.
+Loaded filters are mmapped and shared through the page cache.
+"""
+
+import os
+import math
+import mmap
+import struct
+from hashlib import md5
+
+BLOOM_MAGIC = 'TBLOOM1'
+DEFAULT_ERROR_RATE = 0.01
+
+def bloom_size(count, error_rate=DEFAULT_ERROR_RATE):
+    """
+    Optimal (bits, hashes) for count keys and false positive rate.
+
+    >>> bloom_size(1000000, 0.01)
+    (9585059, 7)
+    >>> bloom_size(0)
+    (10, 7)
+    """
+    if not 0 < error_rate < 1:
+        raise Exception('Bloom filter error rate must be between 0 and 1, got %r' % (error_rate,))
+    count = max(count, 1)
+    bits = int(math.ceil(-count * math.log(error_rate) / math.log(2) ** 2))
+    hashes = int(round(float(bits) / count * math.log(2)))
+    return max(bits, 8), max(hashes, 1)
+
+def _positions(key, bits, hashes):
+    high, low = struct.unpack('<QQ', md5(key).digest())
+    return [(high + num * low) % bits for num in xrange(hashes)]
+
+class BloomFilter(object):
+    """
+    >>> bloom = BloomFilter(*bloom_size(100))
+    >>> for num in xrange(100): bloom.add(str(num))
+    >>> all(str(num) in bloom for num in xrange(100)), sum(str(-num) in bloom for num in xrange(1, 1000)) < 50
+    (True, True)
+    """
+    def __init__(self, bits, hashes, data=None, offset=0, count=0):
+        self.bits = bits
+        self.hashes = hashes
+        self.count = count
+        self.offset = offset
+        if data is None:
+            data = bytearray((bits + 7) // 8)
+        self.data = data
+        # mmap items are chars, bytearray items are ints
+        self.byte_value = ord if isinstance(data, mmap.mmap) else int
+
+    def add(self, key):
+        data = self.data
+        for pos in _positions(key, self.bits, self.hashes):
+            data[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        data = self.data
+        offset = self.offset
+        byte_value = self.byte_value
+        for pos in _positions(key, self.bits, self.hashes):
+            if not byte_value(data[offset + (pos >> 3)]) & (1 << (pos & 7)):
+                return False
+        return True
+
+    def save(self, fname):
+        tmp_fname = fname + '.tmp'
+        with open(tmp_fname, 'wb') as fobj:
+            fobj.write('%s\t%d\t%d\t%d\n' % (BLOOM_MAGIC, self.bits, self.hashes, self.count))
+            fobj.write(self.data)
+        os.rename(tmp_fname, fname)
+
+def load_bloom(fname):
+    """
+    Read-only BloomFilter from a file written by BloomFilter.save.
+    """
+    with open(fname, 'rb') as fobj:
+        header = fobj.readline()
+        fields = header.rstrip('\n').split('\t')
+        if len(fields) != 4 or fields[0] != BLOOM_MAGIC:
+            raise Exception('%r is not a bloom filter file (see tbloom)' % (fname,))
+        bits, hashes, count = [int(field) for field in fields[1:]]
+        if os.fstat(fobj.fileno()).st_size != len(header) + (bits + 7) // 8:
+            raise Exception('Bloom filter file %r is truncated' % (fname,))
+        data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    return BloomFilter(bits, hashes, data, len(header), count)
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,248 @@
+# coding: utf-8
+"""
+Column store: a directory with one file per field.
+
+File "schema" holds line "TCOLSTORE1<tab>rows" and tabkit header of the
+data (fields, #ORDER, #META). Column files are named "<field>.col" and
+start with line "TCOL1<tab>encoding": int64 and float64 columns hold
+native binary numbers, text columns hold values separated by newlines.
+Fields of int/long and float types are written in binary if all their
+values are printed back exactly, otherwise as text.
+Reading a part of the fields opens only their files.
+"""
+
+import os
+import shutil
+from array import array
+from itertools import izip
+
+from tabkit.header import parse_header, make_header
+
+COLSTORE_MAGIC = 'TCOLSTORE1'
+COLUMN_MAGIC = 'TCOL1'
+SCHEMA_FNAME = 'schema'
+
+_CHUNK = 1 << 16 # values written/read at once
+
+def _format_float(value):
+    """
+    >>> [_format_float(float(val)) for val in ['1', '-0.5', '1e+100']]
+    ['1', '-0.5', '1e+100']
+    """
+    text = repr(value)
+    return text[:-2] if text.endswith('.0') else text
+
+def _parse_int64(value):
+    number = int(value)
+    if not -(1 << 63) <= number < (1 << 63):
+        raise OverflowError(value)
+    return number
+
+class _Encoding(object):
+    def __init__(self, name, typecode, parse, format):
+        self.name = name
+        self.typecode = typecode
+        self.parse = parse
+        self.format = format
+
+    def encode(self, value):
+        """
+        Binary value or None if value can't be stored exactly.
+        """
+        try:
+            number = self.parse(value)
+        except (ValueError, OverflowError):
+            return None
+        if self.format(number) != value:
+            return None
+        return number
+
+_INT64 = _Encoding('int64', 'l', _parse_int64, str)
+_FLOAT64 = _Encoding('float64', 'd', float, _format_float)
+_BINARY_ENCODINGS = {
+    'int': _INT64,
+    'long': _INT64,
+    'float': _FLOAT64,
+}
+_ENCODINGS = dict((enc.name, enc) for enc in _BINARY_ENCODINGS.values())
+
+def is_colstore(path):
+    fname = os.path.join(path, SCHEMA_FNAME)
+    if not os.path.isfile(fname):
+        return False
+    with open(fname) as fobj:
+        return fobj.read(len(COLSTORE_MAGIC) + 1) == COLSTORE_MAGIC + '\t'
+
+def column_fname(path, name):
+    return os.path.join(path, name + '.col')
+
+class _ColumnWriter(object):
+    """
+    Writes values of a field in binary encoding while all of them
+    can be encoded, then falls back to text.
+    """
+    def __init__(self, fname, field_type):
+        self.fname = fname
+        self.encoding = _BINARY_ENCODINGS.get(field_type)
+        self.fobj = open(fname + '.data', 'wb')
+        self.values = []
+
+    def add(self, value):
+        self.values.append(value)
+        if len(self.values) >= _CHUNK:
+            self.flush()
+
+    def flush(self):
+        if self.encoding:
+            numbers = array(self.encoding.typecode)
+            for value in self.values:
+                number = self.encoding.encode(value)
+                if number is None:
+                    self._to_text()
+                    break
+                numbers.append(number)
+            else:
+                numbers.tofile(self.fobj)
+        if not self.encoding:
+            self.fobj.writelines(value + '\n' for value in self.values)
+        self.values = []
+
+    def _to_text(self):
+        self.fobj.close()
+        with open(self.fname + '.text', 'wb') as fobj:
+            fobj.writelines(value + '\n' for value in _read_numbers(self.fname + '.data', self.encoding))
+        os.rename(self.fname + '.text', self.fname + '.data')
+        self.fobj = open(self.fname + '.data', 'ab')
+        self.encoding = None
+
+    def close(self):
+        self.flush()
+        self.fobj.close()
+        with open(self.fname, 'wb') as fobj:
+            fobj.write('%s\t%s\n' % (COLUMN_MAGIC, self.encoding.name if self.encoding else 'text'))
+            with open(self.fname + '.data', 'rb') as data:
+                shutil.copyfileobj(data, fobj)
+        os.unlink(self.fname + '.data')
+
+def _read_numbers(fname, encoding, offset=0):
+    """
+    Formatted values of binary column data.
+    """
+    with open(fname, 'rb') as fobj:
+        fobj.seek(offset)
+        while True:
+            numbers = array(encoding.typecode)
+            try:
+                numbers.fromfile(fobj, _CHUNK)
+            except EOFError: # last chunk is read anyway
+                pass
+            if not numbers:
+                break
+            for number in numbers:
+                yield encoding.format(number)
+
+def write_colstore(desc, lines, path):
+    """
+    Writes tab separated lines with fields of desc into path directory.
+    Returns number of rows.
+
+    >>> import tempfile
+    >>> path = tempfile.mktemp()
+    >>> desc = parse_header('# a:int b:float c #ORDER: a\\n')
+    >>> write_colstore(desc, ['1\\t0.5\\tx\\n', '2\\t1\\t\\n', '3\\t1.50\\tz\\n'], path)
+    3
+    >>> [column_encoding(path, name) for name in 'abc']
+    ['int64', 'text', 'text']
+    >>> read_schema(path)
+    (3, '# a:int\\tb:float\\tc #ORDER: a\\n')
+    >>> list(read_lines(path, ['c', 'a']))
+    ['x\\t1\\n', '\\t2\\n', 'z\\t3\\n']
+    >>> path = tempfile.mktemp()
+    >>> write_colstore(parse_header('# a:long'), ['1\\n', '%d\\n' % (1 << 63)], path)
+    2
+    >>> column_encoding(path, 'a'), list(read_column(path, 'a'))
+    ('text', ['1', '9223372036854775808'])
+    >>> write_colstore(desc, ['1\\t2\\n'], tempfile.mktemp())
+    Traceback (most recent call last):
+        ...
+    Exception: Line 1 has 2 fields, expected 3
+    """
+    if os.path.exists(path):
+        raise Exception('Column store %r already exists' % (path,))
+    tmp_path = path + '.tmp'
+    os.mkdir(tmp_path)
+    try:
+        writers = [
+            _ColumnWriter(column_fname(tmp_path, field.name), field.type)
+            for field in desc.fields
+        ]
+        adders = [writer.add for writer in writers]
+        fields_count = len(adders)
+        rows = 0
+        for rows, line in enumerate(lines, 1):
+            values = line.rstrip('\n').split('\t')
+            if len(values) != fields_count:
+                raise Exception('Line %d has %d fields, expected %d' % (rows, len(values), fields_count))
+            for add, value in izip(adders, values):
+                add(value)
+        for writer in writers:
+            writer.close()
+        desc.size = None
+        with open(os.path.join(tmp_path, SCHEMA_FNAME), 'w') as fobj:
+            fobj.write('%s\t%d\n' % (COLSTORE_MAGIC, rows))
+            fobj.write(make_header(desc))
+        os.rename(tmp_path, path)
+    except:
+        shutil.rmtree(tmp_path)
+        raise
+    return rows
+
+def read_schema(path):
+    """
+    Returns (number of rows, header) of column store.
+    """
+    with open(os.path.join(path, SCHEMA_FNAME)) as fobj:
+        fields = fobj.readline().rstrip('\n').split('\t')
+        if len(fields) != 2 or fields[0] != COLSTORE_MAGIC:
+            raise Exception('%r is not a column store' % (path,))
+        return int(fields[1]), fobj.readline()
+
+def column_encoding(path, name):
+    with open(column_fname(path, name), 'rb') as fobj:
+        fields = fobj.readline().rstrip('\n').split('\t')
+    if len(fields) != 2 or fields[0] != COLUMN_MAGIC:
+        raise Exception('Bad column file %r' % (column_fname(path, name),))
+    return fields[1]
+
+def read_column(path, name):
+    """
+    Values of a field as strings.
+    """
+    fname = column_fname(path, name)
+    encoding = column_encoding(path, name)
+    with open(fname, 'rb') as fobj:
+        offset = len(fobj.readline())
+        if encoding == 'text':
+            for line in fobj:
+                yield line[:-1]
+            return
+    if encoding not in _ENCODINGS:
+        raise Exception('Unknown encoding %r of column file %r' % (encoding, fname))
+    for value in _read_numbers(fname, _ENCODINGS[encoding], offset):
+        yield value
+
+def read_lines(path, names):
+    """
+    Tab separated lines of names fields.
+    """
+    columns = [read_column(path, name) for name in names]
+    if len(columns) == 1:
+        return (value + '\n' for value in columns[0])
+    return ('\t'.join(values) + '\n' for values in izip(*columns))
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,295 @@
+# coding: utf-8
+"""
+Sparse index of sorted tabkit files.
+
+The index of FILE is written next to it as FILE.tidx, it is a tabkit
+file itself: every block_size bytes the key (first #ORDER field) of the
+first line starting in the block is stored with the offset of the line.
+Lookups of key ranges and key sets read only blocks that may contain
+matching lines.
+"""
+
+import os
+import re
+
+from tabkit.datasrc import DataDesc, DataField, SortType
+from tabkit.header import parse_header, make_header, read_file_header
+
+INDEX_SUFFIX = '.tidx'
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+_NUM_RE = re.compile(r'\s*(-?(?:\d+(?:\.\d*)?|\.\d+))')
+
+def sort_num(value):
+    """
+    Number as seen by sort -n: leading numeric prefix or 0.
+
+    >>> [sort_num(val) for val in ['12', ' -1.5x', 'abc', '', '.5', '1e3']]
+    [12.0, -1.5, 0.0, 0.0, 0.5, 1.0]
+    """
+    match = _NUM_RE.match(value)
+    if match:
+        return float(match.group(1))
+    return 0.0
+
+def index_path(fname):
+    return fname + INDEX_SUFFIX
+
+class KeyOrder(object):
+    """
+    Position of the index key in lines and its sort order.
+
+    >>> order = KeyOrder(parse_header('# a b #ORDER: b:desc:num'))
+    >>> order.field_name, order.key('x\\t10\\n'), order.before('10', '9')
+    ('b', '10', True)
+    """
+    def __init__(self, desc):
+        if not desc.order:
+            raise Exception('Index lookups need a sorted file (#ORDER in header)')
+        field_order = list(desc.order)[0]
+        if field_order.sort_type not in (SortType.STRING, SortType.NUMERIC):
+            raise Exception('Unsupported sort type %r of indexed field %r' % (
+                field_order.sort_type, field_order.name
+            ))
+        self.field_name = field_order.name
+        self.field_num = desc.field_index(field_order.name)
+        self.numeric = field_order.sort_type == SortType.NUMERIC
+        self.desc = field_order.desc
+
+    def key(self, line):
+        fields = line.rstrip('\n').split('\t', self.field_num + 1)
+        if len(fields) <= self.field_num:
+            return ''
+        return fields[self.field_num]
+
+    def value(self, key):
+        """
+        Comparable value of the key.
+        """
+        return sort_num(key) if self.numeric else key
+
+    def before(self, key1, key2):
+        """
+        True if key1 is sorted strictly before key2.
+        """
+        if self.desc:
+            return self.value(key1) > self.value(key2)
+        return self.value(key1) < self.value(key2)
+
+def build_index(fname, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Returns (desc of the index, [(key, offset), ...]).
+    """
+    header = read_file_header(fname)
+    desc = parse_header(header)
+    order = KeyOrder(desc)
+    stat = os.stat(fname)
+    samples = []
+    with open(fname) as fobj:
+        for pos in xrange(len(header), stat.st_size, block_size):
+            if pos == len(header):
+                fobj.seek(pos)
+            else: # skip to the start of the next line
+                fobj.seek(pos - 1)
+                fobj.readline()
+            offset = fobj.tell()
+            line = fobj.readline()
+            if not line:
+                break
+            if samples and samples[-1][1] == offset:
+                continue
+            samples.append((order.key(line), offset))
+    index_desc = DataDesc(
+        [DataField('key', 'str'), DataField('offset', 'long')],
+        meta = dict(
+            tidx = dict(
+                field = order.field_name,
+                block_size = block_size,
+                source_size = stat.st_size,
+                source_mtime = int(stat.st_mtime),
+            ),
+        ),
+    )
+    return index_desc, samples
+
+def write_index(fname, block_size=DEFAULT_BLOCK_SIZE):
+    index_desc, samples = build_index(fname, block_size)
+    index_fname = index_path(fname)
+    tmp_fname = index_fname + '.tmp'
+    with open(tmp_fname, 'w') as fobj:
+        fobj.write(make_header(index_desc))
+        for key, offset in samples:
+            fobj.write('%s\t%d\n' % (key, offset))
+    os.rename(tmp_fname, index_fname)
+    return len(samples)
+
+def read_index(fname):
+    """
+    Returns [(key, offset), ...] from the index of fname,
+    None if there is no index.
+    """
+    index_fname = index_path(fname)
+    if not os.path.exists(index_fname):
+        return None
+    with open(index_fname) as fobj:
+        index_desc = parse_header(fobj.readline())
+        meta = (index_desc.meta or {}).get('tidx')
+        if not meta:
+            raise Exception('%r is not a tindex file' % (index_fname,))
+        stat = os.stat(fname)
+        if meta['source_size'] != stat.st_size or meta['source_mtime'] != int(stat.st_mtime):
+            raise Exception('Index %r is out of date, rebuild it with tindex' % (index_fname,))
+        samples = []
+        for line in fobj:
+            key, offset = line.rstrip('\n').rsplit('\t', 1)
+            samples.append((key, int(offset)))
+    return samples
+
+def parse_range(range_str):
+    """
+    >>> parse_range('a..b'), parse_range('10..'), parse_range('..z'), parse_range('k')
+    (('a', 'b'), ('10', None), (None, 'z'), ('k', 'k'))
+    """
+    if '..' not in range_str:
+        return range_str, range_str
+    lo, hi = range_str.split('..', 1)
+    return lo or None, hi or None
+
+class KeyLookup(object):
+    """
+    Selects lines whose key is in one of ranges (lo, hi)
+    (None is an open end) or in the set of keys.
+    """
+    def __init__(self, ranges=None, keys=None):
+        self.ranges = list(ranges or [])
+        self.keys = list(keys or [])
+
+    def bounds(self, order):
+        """
+        Key bounds (first, last) in file order for every range and key.
+        """
+        bounds = []
+        for lo, hi in self.ranges + [(key, key) for key in self.keys]:
+            if order.desc:
+                lo, hi = hi, lo
+            bounds.append((lo, hi))
+        return bounds
+
+    def matcher(self, order):
+        values = set(order.value(key) for key in self.keys)
+        ranges = [
+            (
+                None if lo is None else order.value(lo),
+                None if hi is None else order.value(hi),
+            )
+            for lo, hi in self.ranges
+        ]
+        def match(key):
+            value = order.value(key)
+            if value in values:
+                return True
+            for lo, hi in ranges:
+                if (lo is None or lo <= value) and (hi is None or value <= hi):
+                    return True
+            return False
+        return match
+
+    def byte_ranges(self, order, samples, data_range):
+        """
+        Sorted non-overlapping byte ranges of data_range (start, end)
+        which may contain matching lines.
+
+        >>> order = KeyOrder(parse_header('# k #ORDER: k'))
+        >>> samples = [('a', 2), ('c', 10), ('c', 20), ('f', 30)]
+        >>> KeyLookup([('c', 'd')]).byte_ranges(order, samples, (2, 40))
+        [(2, 30)]
+        >>> KeyLookup([('g', None)], ['a']).byte_ranges(order, samples, (2, 40))
+        [(2, 10), (30, 40)]
+        >>> KeyLookup(keys=['0']).byte_ranges(order, samples, (2, 40))
+        []
+        """
+        start, end = data_range
+        keys = [key for key, offset in samples]
+        result = []
+        for first, last in self.bounds(order):
+            lo_num = 0 if first is None else _bisect(keys, first, order, strict=True)
+            hi_num = len(keys) if last is None else _bisect(keys, last, order, strict=False)
+            lo = samples[lo_num - 1][1] if lo_num > 0 else start
+            hi = samples[hi_num][1] if hi_num < len(samples) else end
+            if lo < hi:
+                result.append((lo, hi))
+        result.sort()
+        merged = []
+        for lo, hi in result:
+            if merged and lo <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+            else:
+                merged.append((lo, hi))
+        return merged
+
+def _bisect(keys, key, order, strict):
+    """
+    Number of keys sorted before key (strict) or not after it.
+    """
+    lo, hi = 0, len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if order.before(keys[mid], key) or (not strict and not order.before(key, keys[mid])):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def read_keys(fname):
+    """
+    Keys for --keys-from: first field of every line, tabkit header is skipped.
+    """
+    keys = []
+    with open(fname) as fobj:
+        for num, line in enumerate(fobj):
+            if num == 0 and line.startswith('# '):
+                continue
+            keys.append(line.rstrip('\n').split('\t', 1)[0])
+    return keys
+
+def lookup_lines(fname, data_range, lookup, order, samples):
+    """
+    Yields lines of fname within data_range matching lookup,
+    reading only blocks pointed by samples of read_index
+    (whole data if there is no index).
+    """
+    if samples is None:
+        byte_ranges = [data_range]
+    else:
+        byte_ranges = lookup.byte_ranges(order, samples, data_range)
+    match = lookup.matcher(order)
+    with open(fname) as fobj:
+        for lo, hi in byte_ranges:
+            fobj.seek(lo)
+            pos = lo
+            while pos < hi:
+                line = fobj.readline()
+                if not line:
+                    break
+                pos += len(line)
+                if match(order.key(line)):
+                    yield line
+
+def lookup_from_opts(opts):
+    """
+    KeyLookup from --range and --keys-from options, None if not given.
+    """
+    ranges = [parse_range(range_str) for range_str in opts.ranges or []]
+    keys = []
+    for fname in opts.keys_from or []:
+        keys.extend(read_keys(fname))
+    if not (ranges or keys or opts.keys_from):
+        return None
+    return KeyLookup(ranges, keys)
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
@@ -0,0 +1,266 @@
+# coding: utf-8
+"""
+In-process joins of tabkit files.
+
+Rows are lists of fields, key_fields are tuples of key field names
+of every file, output is described by sources: (fileno, field_index)
+for every output field, fileno None means position in the join key
+(its value is taken from any file present in the output row).
+"""
+
+from collections import defaultdict
+from heapq import heapify, heappush, heappop
+from itertools import groupby, product
+from operator import itemgetter
+
+def raise_conflict(name):
+    raise Exception((
+        "Field name {0!r} presents in both files,"
+        " use -r/-o/-c option to resolve conflict"
+    ).format(name))
+
+def default_output_names(descs, key_fields, filenum_c=None):
+    """
+    Default output: all fields of the first file, then fields of
+    the next files except their key fields.
+
+    >>> from tabkit.header import parse_header
+    >>> descs = [parse_header('# a b c'), parse_header('# a2 d')]
+    >>> default_output_names(descs, [('a',), ('a2',)])
+    ['a', 'b', 'c', 'd']
+    """
+    names = []
+    for fileno, desc in enumerate(descs):
+        for field in desc.fields:
+            if fileno > 0 and field.name in key_fields[fileno]:
+                continue
+            if field.name in names:
+                if not filenum_c:
+                    raise_conflict(field.name)
+            else:
+                names.append(field.name)
+    return names
+
+def output_sources(descs, key_fields, names, filenum_c=None):
+    """
+    Returns (output fields, sources) for output field names.
+    A name is the join key if it is a key field of the first file
+    or a key field of every file having it, otherwise the field
+    is taken from the file where it is not a key field.
+
+    >>> from tabkit.header import parse_header
+    >>> descs = [parse_header('# a b c'), parse_header('# a2 c d')]
+    >>> fields, sources = output_sources(descs, [('a',), ('a2',)], ['d', 'a2', 'c'], 2)
+    >>> [field.name for field in fields], sources
+    (['d', 'a2', 'c'], [(1, 2), (None, 0), (1, 1)])
+    >>> descs = [parse_header('# a b'), parse_header('# b c')]
+    >>> output_sources(descs, [('a',), ('b',)], ['a', 'b', 'c'])[1]
+    [(None, 0), (0, 1), (1, 1)]
+    """
+    fields = []
+    sources = []
+    for name in names:
+        filenos = [fileno for fileno, desc in enumerate(descs) if desc.has_field(name)]
+        if not filenos:
+            raise Exception("Unknown field {0!r} specified in output format".format(name))
+        key_filenos = [fileno for fileno in filenos if name in key_fields[fileno]]
+        if 0 in key_filenos or key_filenos == filenos:
+            fileno = key_filenos[0]
+            fields.append(descs[fileno].get_field(name))
+            sources.append((None, key_fields[fileno].index(name)))
+            continue
+        filenos = [fileno for fileno in filenos if fileno not in key_filenos]
+        if len(filenos) > 1:
+            if not filenum_c:
+                raise_conflict(name)
+            fileno = filenum_c - 1
+        else:
+            fileno = filenos[0]
+        fields.append(descs[fileno].get_field(name))
+        sources.append((fileno, descs[fileno].field_index(name)))
+    return fields, sources
+
+def key_getter(desc, keys):
+    """
+    Function returning key tuple of a row.
+    """
+    indexes = [desc.field_index(key) for key in keys]
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    return itemgetter(*indexes)
+
+def split_rows(lines):
+    for line in lines:
+        yield line.rstrip('\n').split('\t')
+
+def prefilter_rows(rows, key, keys):
+    """
+    Rows whose key (fields joined by tabs) may be in keys,
+    e.g. in tabkit.bloom.BloomFilter.
+
+    >>> list(prefilter_rows([['a', '1'], ['b', '2']], itemgetter(0, 1), set(['b\\t2'])))
+    [['b', '2']]
+    """
+    for row in rows:
+        if '\t'.join(key(row)) in keys:
+            yield row
+
+class RowMaker(object):
+    """
+    Formats output lines from rows of files (None for absent ones).
+    """
+    def __init__(self, key_indexes, sources, empty=None):
+        self.key_indexes = key_indexes
+        self.sources = sources
+        self.empty = empty or ''
+        self.getters = {}
+
+    def _getter(self, present):
+        getter = []
+        for fileno, index in self.sources:
+            if fileno is None:
+                fileno, index = present[0], self.key_indexes[present[0]][index]
+            getter.append((fileno, index) if fileno in present else None)
+        return getter
+
+    def __call__(self, rows):
+        present = tuple(fileno for fileno, row in enumerate(rows) if row is not None)
+        getter = self.getters.get(present)
+        if getter is None:
+            getter = self.getters[present] = self._getter(present)
+        empty = self.empty
+        return '\t'.join([
+            empty if src is None else rows[src[0]][src[1]]
+            for src in getter
+        ]) + '\n'
+
+def hash_join(build_rows, probe_rows, build_no, keys, make_row, filenum_a=(), filenum_v=()):
+    """
+    Join of two files without sorting: rows of file build_no are loaded
+    into a dict, rows of the other file are streamed in their order.
+    filenum_a and filenum_v are file indexes with join -a/-v meaning,
+    unpaired rows of the loaded file are printed at the end.
+
+    >>> make_row = RowMaker([[0], [0]], [(None, 0), (0, 1), (1, 1)], 'NA')
+    >>> keys = [itemgetter(0), itemgetter(0)]
+    >>> build = [['k1', 'b1'], ['k1', 'b2'], ['k3', 'b3']]
+    >>> probe = [['k2', 'p2'], ['k1', 'p1']]
+    >>> list(hash_join(build, probe, 0, keys, make_row))
+    ['k1\\tb1\\tp1\\n', 'k1\\tb2\\tp1\\n']
+    >>> list(hash_join(build, probe, 0, keys, make_row, filenum_a=[0, 1]))
+    ['k2\\tNA\\tp2\\n', 'k1\\tb1\\tp1\\n', 'k1\\tb2\\tp1\\n', 'k3\\tb3\\tNA\\n']
+    >>> list(hash_join(build, probe, 0, keys, make_row, filenum_v=[0]))
+    ['k3\\tb3\\tNA\\n']
+    """
+    probe_no = 1 - build_no
+    build_rows = list(build_rows)
+    build_key = keys[build_no]
+    probe_key = keys[probe_no]
+    table = defaultdict(list)
+    for row in build_rows:
+        table[build_key(row)].append(row)
+    print_joined = not filenum_v
+    unpaired = set(filenum_a) | set(filenum_v)
+    matched = set()
+    rows = [None, None]
+    for row in probe_rows:
+        key = probe_key(row)
+        pairs = table.get(key)
+        if pairs:
+            if build_no in unpaired:
+                matched.add(key)
+            if print_joined:
+                rows[probe_no] = row
+                for pair in pairs:
+                    rows[build_no] = pair
+                    yield make_row(rows)
+        elif probe_no in unpaired:
+            yield make_row([row, None] if probe_no == 0 else [None, row])
+    if build_no in unpaired:
+        for row in build_rows:
+            if build_key(row) not in matched:
+                yield make_row([row, None] if build_no == 0 else [None, row])
+
+def _sorted_groups(rows, key, fileno):
+    """
+    Groups of rows with equal keys, checks that keys increase.
+    """
+    last_key = None
+    for group_key, group in groupby(rows, key):
+        if last_key is not None and group_key < last_key:
+            raise Exception("File {0!r} is not sorted by join key: {1!r} after {2!r}".format(
+                fileno + 1, ';'.join(group_key), ';'.join(last_key),
+            ))
+        last_key = group_key
+        yield group_key, list(group)
+
+def merge_join(rows_list, keys, make_row, filenum_a=(), filenum_v=()):
+    """
+    Join of files sorted by key (as LC_ALL=C sort does) in one pass,
+    groups of rows with equal keys are merged using a heap and all
+    combinations of rows of the groups are joined.
+    filenum_a and filenum_v are file indexes with join -a/-v meaning:
+    a key missing in some files is printed if it is present in one
+    of these files, -v suppresses keys present in all files.
+
+    >>> make_row = RowMaker([[0, 1], [0, 1]], [(None, 0), (None, 1), (0, 2), (1, 2)], '-')
+    >>> keys = [itemgetter(0, 1), itemgetter(0, 1)]
+    >>> left = [['a', 'x', 'l1'], ['a', 'x', 'l2'], ['b', 'x', 'l3']]
+    >>> right = [['a', 'x', 'r1'], ['a', 'y', 'r2'], ['a', 'x', 'r3']]
+    >>> list(merge_join([left, right[:2]], keys, make_row, filenum_a=[1]))
+    ['a\\tx\\tl1\\tr1\\n', 'a\\tx\\tl2\\tr1\\n', 'a\\ty\\t-\\tr2\\n']
+    >>> list(merge_join([left, right[:2]], keys, make_row, filenum_v=[0]))
+    ['b\\tx\\tl3\\t-\\n']
+    >>> list(merge_join([left, right], keys, make_row))
+    Traceback (most recent call last):
+        ...
+    Exception: File 2 is not sorted by join key: 'a;x' after 'a;y'
+
+    >>> make_row = RowMaker([[0]] * 3, [(None, 0), (0, 1), (1, 1), (2, 1)], '-')
+    >>> keys = [itemgetter(0)] * 3
+    >>> files = [[['1', 'a'], ['2', 'b']], [['1', 'c'], ['3', 'd']], [['1', 'e'], ['2', 'f']]]
+    >>> list(merge_join(files, keys, make_row))
+    ['1\\ta\\tc\\te\\n']
+    >>> list(merge_join(files, keys, make_row, filenum_a=[2]))
+    ['1\\ta\\tc\\te\\n', '2\\tb\\t-\\tf\\n']
+    """
+    files_count = len(rows_list)
+    print_joined = not filenum_v
+    unpaired = set(filenum_a) | set(filenum_v)
+    groups = [
+        _sorted_groups(rows, key, fileno)
+        for fileno, (rows, key) in enumerate(zip(rows_list, keys))
+    ]
+    heap = []
+    for fileno, file_groups in enumerate(groups):
+        group = next(file_groups, None)
+        if group is not None:
+            heap.append((group[0], fileno, group[1]))
+    heapify(heap)
+    while heap:
+        if len(heap) < files_count and not unpaired:
+            break # some file has ended, nothing to join
+        key = heap[0][0]
+        key_groups = [None] * files_count
+        while heap and heap[0][0] == key:
+            _, fileno, rows = heappop(heap)
+            key_groups[fileno] = rows
+            group = next(groups[fileno], None)
+            if group is not None:
+                heappush(heap, (group[0], fileno, group[1]))
+        present = [fileno for fileno, rows in enumerate(key_groups) if rows is not None]
+        if len(present) == files_count:
+            if not print_joined:
+                continue
+        elif not unpaired.intersection(present):
+            continue
+        for rows in product(*[rows or [None] for rows in key_groups]):
+            yield make_row(rows)
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
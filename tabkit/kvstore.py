@@ -0,0 +1,130 @@
+# coding: utf-8
+"""
+Persistent key/value files for map_from_file.
+
+File format: text line "TDICT1<tab>count<tab>data_size", then data
+of "key<tab>value\\n" records sorted by key (as LC_ALL=C sort does),
+then offsets of the records in data as little-endian uint64.
+Files are mmapped and looked up by binary search without loading,
+so parallel processes share one page-cache copy.
+"""
+
+import os
+import mmap
+import struct
+import shutil
+from tempfile import TemporaryFile
+
+KVSTORE_MAGIC = 'TDICT1'
+
+_OFFSET = struct.Struct('<Q')
+
+def is_kvstore(fname):
+    with open(fname, 'rb') as fobj:
+        return fobj.read(len(KVSTORE_MAGIC) + 1) == KVSTORE_MAGIC + '\t'
+
+def write_kvstore(pairs, fname):
+    """
+    Writes (key, value) pairs sorted by key, of equal keys the last is kept.
+    Returns number of keys written.
+
+    >>> import tempfile
+    >>> fname = tempfile.mktemp()
+    >>> write_kvstore([('a', '1'), ('b', '2'), ('b', '3'), ('c', '')], fname)
+    3
+    >>> store = KVStore(fname)
+    >>> [store.get(key, 'none') for key in ['a', 'b', 'c', 'd', '']], len(store)
+    (['1', '3', '', 'none', 'none'], 3)
+    >>> write_kvstore([('b', '2'), ('a', '1')], fname)
+    Traceback (most recent call last):
+        ...
+    Exception: Keys are not sorted: 'a' after 'b'
+    """
+    data = TemporaryFile()
+    index = TemporaryFile()
+    try:
+        offsets = [0]
+        def write_record(key, value):
+            record = '%s\t%s\n' % (key, value)
+            index.write(_OFFSET.pack(offsets[-1]))
+            data.write(record)
+            offsets[-1] += len(record)
+
+        count = 0
+        last = None
+        for key, value in pairs:
+            if last is not None and key != last[0]:
+                if key < last[0]:
+                    raise Exception('Keys are not sorted: %r after %r' % (key, last[0]))
+                write_record(*last)
+                count += 1
+            last = key, value
+        if last is not None:
+            write_record(*last)
+            count += 1
+        data_size = offsets[-1]
+
+        tmp_fname = fname + '.tmp'
+        with open(tmp_fname, 'wb') as fobj:
+            fobj.write('%s\t%d\t%d\n' % (KVSTORE_MAGIC, count, data_size))
+            for part in (data, index):
+                part.seek(0)
+                shutil.copyfileobj(part, fobj)
+        os.rename(tmp_fname, fname)
+    finally:
+        data.close()
+        index.close()
+    return count
+
+class KVStore(object):
+    """
+    Read-only mmapped file written by write_kvstore, used like a dict.
+    """
+    def __init__(self, fname):
+        with open(fname, 'rb') as fobj:
+            header = fobj.readline()
+            fields = header.rstrip('\n').split('\t')
+            if len(fields) != 3 or fields[0] != KVSTORE_MAGIC:
+                raise Exception('%r is not a tdict file' % (fname,))
+            self.count, data_size = int(fields[1]), int(fields[2])
+            self.data_offset = len(header)
+            self.index_offset = self.data_offset + data_size
+            if os.fstat(fobj.fileno()).st_size != self.index_offset + self.count * _OFFSET.size:
+                raise Exception('tdict file %r is truncated' % (fname,))
+            self.data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, num):
+        start = self.data_offset + _OFFSET.unpack_from(
+            self.data, self.index_offset + num * _OFFSET.size
+        )[0]
+        return start, self.data.find('\t', start)
+
+    def get(self, key, default=None):
+        data = self.data
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end = self._record(mid)
+            if data[start:end] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            start, end = self._record(lo)
+            if data[start:end] == key:
+                return data[end + 1:data.find('\n', end)]
+        return default
+
+    def __contains__(self, key):
+        marker = []
+        return self.get(key, marker) is not marker
+
+def _test(): # pylint: disable-msg=E0102
+    import doctest
+    doctest.testmod()
+
+if __name__ == "__main__":
+    _test()
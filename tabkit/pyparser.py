@@ -1,7 +1,8 @@
-from itertools import islice, tee, izip
+from itertools import islice, tee, izip, imap
+from array import array
 from tabkit.header import parse_header, parse_header_order
 from tabkit.datasrc import DataDesc
-from tabkit._fileparser import FileParser, RecParser
+from tabkit._fileparser import FileParser, RecParser, LazyRecParser, ColumnsFileParser
 
 TYPE_MAP = {
     'str'  : str,
@@ -12,10 +13,42 @@ TYPE_MAP = {
     'any'  : str,
 }
 
+def _array_column(typecode, conv):
+    def array_column(values):
+        return array(typecode, map(conv, values))
+    return array_column
+
+def _numpy_column(dtype, conv):
+    def numpy_column(values):
+        import numpy
+        return numpy.fromiter(imap(conv, values), dtype, len(values))
+    return numpy_column
+
+COLUMN_MAP = {
+    'str'  : list,
+    'int'  : _array_column('l', int),
+    'long' : _array_column('l', int),
+    'float': _array_column('d', float),
+    'bool' : _array_column('b', TYPE_MAP['bool']),
+    'any'  : list,
+}
+
+NUMPY_COLUMN_MAP = {
+    'str'  : list,
+    'int'  : _numpy_column('i8', int),
+    'long' : _numpy_column('i8', int),
+    'float': _numpy_column('f8', float),
+    'bool' : _numpy_column('?', TYPE_MAP['bool']),
+    'any'  : list,
+}
+
 class ParsedFile(object):
-    def __init__(self, data_desc, recs):
+    def __init__(self, data_desc, recs, fields=None):
         self.data_desc = data_desc
         self.recs = recs
+        if fields is None:
+            fields = [field.name for field in data_desc.fields]
+        self.fields = list(fields)
     def __iter__(self):
         return self.recs
     def next(self):
@@ -25,30 +58,99 @@ class ParsedFile(object):
             if name.startswith(prefix):
                 yield name
 
-def parse_file(lines, require_order=None):
+def parse_file(lines, require_order=None, lazy=False, fields=None):
     """
+    With lazy=True records keep the raw split line and every field
+    is converted on its first access (the result is cached in the record).
+
+    With fields=[...] only the listed fields are parsed, records contain
+    just these fields (in the given order), the rest of the line is not split.
+
     >>> lines = ['# q:str ans:str s:int c:int rel:float\\n', 'url\\tph\\t1000\\t15\\t1.2\\n']
     >>> list(parse_file(lines))
     [Rec(q='url', ans='ph', s=1000, c=15, rel=1.2)]
+    >>> rec = next(iter(parse_file(lines, lazy=True)))
+    >>> rec.s, rec.rel
+    (1000, 1.2)
+    >>> parsed = parse_file(lines, fields=['c', 'q'])
+    >>> parsed.fields, list(parsed)
+    (['c', 'q'], [Rec(c=15, q='url')])
+    >>> parse_file(lines, fields=['x'])
+    Traceback (most recent call last):
+        ...
+    Exception: Unknown field 'x' in ['q', 'ans', 's', 'c', 'rel']
+    """
+    lines_iter = iter(lines)
+    data_desc = _read_header(lines_iter, require_order)
+    field_indexes = _field_indexes(data_desc, fields)
+    field_spec = _field_spec(data_desc, TYPE_MAP, field_indexes)
+    parser = FileParser(
+        field_separator = '\t',
+        rec_parser = (LazyRecParser if lazy else RecParser)(field_spec),
+        field_indexes = field_indexes,
+    )
+    return ParsedFile(data_desc, parser(lines_iter), fields)
+
+def parse_file_batches(lines, batch_size=10000, require_order=None, fields=None, numpy=False):
+    """
+    Reads batch_size lines at a time, every batch is a record
+    with a column per field: array('l') for int and long, array('d') for float,
+    array('b') for bool and lists for str and any fields.
+    With numpy=True numeric columns are int64, float64 and bool numpy arrays.
+
+    >>> lines = ['# q:str s:int rel:float ok:bool\\n', 'a\\t1\\t0.5\\t1\\n', 'b\\t2\\t1.5\\t0\\n', 'c\\t3\\t2.5\\t1\\n']
+    >>> for batch in parse_file_batches(lines, 2):
+    ...     print batch
+    Batch(q=['a', 'b'], s=array('l', [1, 2]), rel=array('d', [0.5, 1.5]), ok=array('b', [1, 0]))
+    Batch(q=['c'], s=array('l', [3]), rel=array('d', [2.5]), ok=array('b', [1]))
+    >>> batches = parse_file_batches(lines, fields=['rel'])
+    >>> batches.fields, [sum(batch.rel) for batch in batches]
+    (['rel'], [4.5])
     """
     lines_iter = iter(lines)
+    data_desc = _read_header(lines_iter, require_order)
+    field_indexes = _field_indexes(data_desc, fields)
+    parser = ColumnsFileParser(
+        fields_spec = _field_spec(
+            data_desc, NUMPY_COLUMN_MAP if numpy else COLUMN_MAP, field_indexes
+        ),
+        batch_size = batch_size,
+        field_separator = '\t',
+        field_indexes = field_indexes,
+    )
+    return ParsedFile(data_desc, parser(lines_iter), fields)
+
+def _read_header(lines_iter, require_order):
     header = list(islice(lines_iter, 1))
-    if len(header) == 1:
-        data_desc = parse_header(header[0])
-        if require_order:
-            if not data_desc.order.is_ordered_by(parse_header_order(require_order)):
-                raise Exception('require_order check of {0} failure on {1}.'.format(require_order, data_desc.order))
-        field_spec = []
-        for field in data_desc.fields:
-            field_spec.append((field.name, TYPE_MAP[field.type]))
-        parser = FileParser(
-            field_separator = '\t',
-            rec_parser = RecParser(field_spec),
-        )
-        return ParsedFile(data_desc, parser(lines_iter))
-    else:
+    if len(header) != 1:
         raise Exception("No header")
-        
+    data_desc = parse_header(header[0])
+    if require_order:
+        if not data_desc.order.is_ordered_by(parse_header_order(require_order)):
+            raise Exception('require_order check of {0} failure on {1}.'.format(require_order, data_desc.order))
+    return data_desc
+
+def _field_indexes(data_desc, fields):
+    if fields is None:
+        return None
+    field_indexes = []
+    for name in fields:
+        if not data_desc.has_field(name):
+            raise Exception('Unknown field {0!r} in {1!r}'.format(
+                name, [field.name for field in data_desc.fields]
+            ))
+        field_indexes.append(data_desc.field_index(name))
+    return field_indexes
+
+def _field_spec(data_desc, type_map, field_indexes=None):
+    field_spec = []
+    for field in data_desc.fields:
+        field_spec.append((field.name, type_map[field.type]))
+    if field_indexes is not None:
+        field_spec = [field_spec[idx] for idx in field_indexes]
+    return field_spec
+
+
 def parse_file_keeplines(lines, require_order=None):
     r"""
     >>> def gen_lines(x):
@@ -1,5 +1,8 @@
 # coding: utf-8
 
+import os
+import select
+from collections import deque
 from subprocess import Popen, PIPE
 from signal import signal, SIGPIPE, SIG_DFL
 
@@ -68,6 +71,106 @@ def safe_popen(command, bufsize=None):
     else:
         popen.close()
 
+class SafePopenFile(object):
+    """
+    Output of command as a file object, close() waits for
+    the command and raises SafePopenError if it failed.
+
+    >>> with SafePopenFile('echo ok') as fobj:
+    ...     list(fobj)
+    ['ok\\n']
+
+    >>> with SafePopenFile('echo ok; false') as fobj:
+    ...     fobj.read()
+    Traceback (most recent call last):
+        ...
+    SafePopenError: safe_popen failed on 'echo ok; false', status = 1
+    """
+    def __init__(self, command):
+        self.popen = SafePopen(command)
+
+    def __getattr__(self, name):
+        return getattr(self.popen.stdout, name)
+
+    def __iter__(self):
+        return iter(self.popen.stdout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.popen.close()
+
+def safe_popen_concat(commands, ahead=1, buffer_size=1 << 24, chunk_size=1 << 16):
+    """
+    Output of commands concatenated in their order by chunks.
+    Up to ahead next commands run along with the current one,
+    their output is kept in memory up to buffer_size bytes
+    per command, then they wait for their turn.
+    A command can be given by a function returning it, which is
+    called when the command is started.
+
+    >>> ''.join(safe_popen_concat(['sleep 0.1; echo 1', 'echo 2', 'echo 3'], ahead=2))
+    '1\\n2\\n3\\n'
+
+    >>> started = []
+    >>> def command(num):
+    ...     started.append(num)
+    ...     return 'echo %d' % (num,)
+    >>> chunks = safe_popen_concat([lambda num=num: command(num) for num in range(4)], ahead=1)
+    >>> next(chunks), started
+    ('0\\n', [0, 1])
+    >>> ''.join(chunks), started
+    ('1\\n2\\n3\\n', [0, 1, 2, 3])
+
+    >>> list(safe_popen_concat(['echo 1', 'false']))
+    Traceback (most recent call last):
+        ...
+    SafePopenError: safe_popen failed on 'false', status = 1
+    """
+    commands = deque(commands)
+    running = deque() # [popen, chunks, size, eof]
+    by_fd = {}
+    poller = select.poll()
+    try:
+        while running or commands:
+            while commands and len(running) <= ahead:
+                command = commands.popleft()
+                popen = SafePopen(command() if callable(command) else command)
+                entry = [popen, deque(), 0, False]
+                running.append(entry)
+                by_fd[popen.stdout.fileno()] = entry # pylint: disable-msg=E1101
+                poller.register(popen.stdout, select.POLLIN) # pylint: disable-msg=E1101
+            current = running[0]
+            while current[1]:
+                yield current[1].popleft()
+            current[2] = 0
+            if current[3]:
+                running.popleft()
+                current[0].close()
+                continue
+            for fd, entry in by_fd.iteritems():
+                full = entry is not current and entry[2] >= buffer_size
+                poller.modify(fd, 0 if full else select.POLLIN)
+            for fd, event in poller.poll():
+                entry = by_fd[fd]
+                data = os.read(fd, chunk_size)
+                if data:
+                    entry[1].append(data)
+                    entry[2] += len(data)
+                else:
+                    entry[3] = True
+                    poller.unregister(fd)
+                    del by_fd[fd]
+    finally:
+        for popen, chunks, size, eof in running:
+            if popen.returncode is None:
+                popen.stdout.close() # pylint: disable-msg=E1101
+                popen.wait() # pylint: disable-msg=E1101
+
 def safe_system(command, catch_sigpipe=False):
     popen = Popen(
         args = safe_popen_args(command),
@@ -2,17 +2,25 @@ from __future__ import with_statement
 
 import sys
 import os
-import gzip
+import multiprocessing
+import threading
+from Queue import Queue, Full
+from cStringIO import StringIO
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE
 from collections import defaultdict
 from pipes import quote
 from itertools import islice
+from signal import SIGTERM
 from optparse import IndentedHelpFormatter
 from textwrap import dedent
 
-from tabkit.header import parse_header, read_fd_header, read_file_header
+from tabkit.header import parse_header, make_header, read_fd_header, read_file_header
 from tabkit.datasrc import DataDesc, merge_data_fields, merge_meta
-from tabkit.safe_popen import safe_popen, safe_system
+from tabkit.safe_popen import SafePopen, SafePopenFile, safe_popen, safe_system
+from tabkit.index import KeyOrder, read_index, lookup_lines
+from tabkit.colstore import is_colstore, read_schema, read_lines
+from tabkit.blockgz import is_block_gzip, read_block_index, read_blocks, block_groups
 
 try:
     from functools import partial
@@ -70,29 +78,120 @@ class PlainFile(InputFile):
             return quote(self.fname)
     def is_stdin(self):
         return False
+    def data_range(self):
+        """
+        Byte range of the file data (without header).
+        """
+        start = len(self.header) if self.has_header else 0
+        return start, os.path.getsize(self.fname)
+    def range_cmds(self, parts):
+        """
+        Shell commands printing file data in up to parts pieces.
+        """
+        cmds = []
+        for start, end in line_ranges(self.fname, self.data_range(), parts):
+            # dd reads exactly the range, so no SIGPIPE unlike tail | head
+            cmd = 'dd if=%s bs=1M iflag=skip_bytes,count_bytes skip=%d' % (quote(self.fname), start)
+            if end != os.path.getsize(self.fname):
+                cmd += ' count=%d' % (end - start,)
+            cmds.append(cmd + ' status=none')
+        return cmds
+
+def line_ranges(fname, data_range, parts):
+    """
+    Splits data_range (start, end) of file into up to parts
+    byte ranges of about the same size ending on line boundaries.
+
+    >>> import tempfile
+    >>> fobj = tempfile.NamedTemporaryFile()
+    >>> fobj.write('# a\\n1\\n22\\n333\\n4444\\n55555\\n'); fobj.flush()
+    >>> line_ranges(fobj.name, (4, 24), 3)
+    [(4, 13), (13, 18), (18, 24)]
+    >>> line_ranges(fobj.name, (4, 24), 100)
+    [(4, 6), (6, 9), (9, 13), (13, 18), (18, 24)]
+    >>> line_ranges(fobj.name, (24, 24), 2)
+    []
+    """
+    start, end = data_range
+    bounds = [start]
+    with open(fname) as fobj:
+        for num in xrange(1, parts):
+            pos = start + (end - start) * num // parts
+            if pos <= bounds[-1]:
+                continue
+            fobj.seek(pos - 1)
+            fobj.readline()
+            pos = fobj.tell()
+            if bounds[-1] < pos < end:
+                bounds.append(pos)
+    bounds.append(end)
+    return [(lo, hi) for lo, hi in zip(bounds, bounds[1:]) if lo < hi]
+
+# magic bytes of compressed files and their decompressors, fastest first
+COMPRESSIONS = [
+    ('gzip', '\x1f\x8b', ['pigz -cd', 'gzip -cd']),
+    ('zstd', '\x28\xb5\x2f\xfd', ['zstd -T0 -qcd']),
+    ('xz', '\xfd7zXZ\x00', ['xz -T0 -cd']),
+    ('lz4', '\x04\x22\x4d\x18', ['lz4 -qcd']),
+]
+
+def sniff_compression(fname):
+    """
+    Compression format of file by its magic bytes, None if unknown.
+
+    >>> import tempfile
+    >>> fobj = tempfile.NamedTemporaryFile()
+    >>> fobj.write('\x28\xb5\x2f\xfd...'); fobj.flush()
+    >>> sniff_compression(fobj.name), sniff_compression('/dev/null')
+    ('zstd', None)
+    """
+    with open(fname, 'rb') as fobj:
+        head = fobj.read(max(len(magic) for name, magic, cmds in COMPRESSIONS))
+    for name, magic, cmds in COMPRESSIONS:
+        if head.startswith(magic):
+            return name
+    return None
+
+def decompress_cmd(compression):
+    """
+    Fastest available command decompressing files of compression format.
+    """
+    for name, magic, cmds in COMPRESSIONS:
+        if name == compression:
+            for cmd in cmds:
+                if exec_path(cmd.split()[0]):
+                    return cmd
+            raise Exception('No %s decompressor found, tried %s' % (
+                name, ', '.join(cmd.split()[0] for cmd in cmds),
+            ))
+    raise Exception('Unknown compression %r' % (compression,))
 
 class GzipFile(InputFile):
-    def __init__(self, fname, header=None):
+    """
+    Compressed file (gzip, zstd, xz or lz4) read by decompressor command.
+    """
+    def __init__(self, fname, header=None, compression='gzip'):
         self.fname = fname
+        self.compression = compression
         self.has_header = not header
         if not self.has_header:
             self.header = header
         else:
-            fobj = gzip.open(fname)
+            popen = SafePopen('%s %s' % (decompress_cmd(compression), quote(fname)))
             try:
-                self.header = fobj.readline()
+                self.header = popen.stdout.readline()
             finally:
-                fobj.close()
-    def get_fileobj(self):
-        fileobj = gzip.open(self.fname)
+                popen.stdout.close()
+                popen.wait() # decompressor is killed by SIGPIPE
+    def data_cmd(self):
+        cmd = '%s %s' % (decompress_cmd(self.compression), quote(self.fname))
         if self.has_header:
-            fileobj.readline()
-        return fileobj
+            cmd += ' | tail -qn +2'
+        return cmd
+    def get_fileobj(self):
+        return SafePopenFile(self.data_cmd())
     def cmd_arg(self):
-        if self.has_header:
-            return "<(set -o pipefail; gzip -cd %s|tail -qn +2 || kill $$)" % (quote(self.fname),)
-        else:
-            return "<(gzip -cd %s || kill $$)" % (quote(self.fname),)
+        return "<(set -o pipefail; %s || kill $$)" % (self.data_cmd(),)
     def is_stdin(self):
         return False
 
@@ -119,14 +218,164 @@ class StdinFile(StreamFile):
     def __init__(self, header=None):
         super(StdinFile, self).__init__('-', sys.stdin, header)
 
-def input_file_from_cmdline_arg(fname, header=None, gzip=False):
+def fork_lines(make_lines):
+    """
+    Forks a process writing make_lines() into a pipe,
+    returns read end of the pipe.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            with os.fdopen(write_fd, 'w') as fobj:
+                fobj.writelines(make_lines())
+        except IOError: # reader has gone
+            pass
+        except Exception, err:
+            sys.stderr.write('%s: %s: %s\n' % (sys.argv[0], err.__class__.__name__, err))
+            os.kill(os.getppid(), SIGTERM)
+            status = 1
+        os._exit(status)
+    os.close(write_fd)
+    return read_fd
+
+class IndexedFile(PlainFile):
+    """
+    Sorted regular file of which only lines matching lookup
+    (tabkit.index.KeyLookup) are read, using FILE.tidx index if present.
+    Lines are written by a forked process into a pipe.
+    """
+    def __init__(self, fname, lookup, header=None):
+        super(IndexedFile, self).__init__(fname, header)
+        self.lookup = lookup
+        self.order = KeyOrder(self.desc())
+        self.samples = read_index(fname)
+        self.fd = None
+    def _open(self):
+        if self.fd is not None:
+            raise Exception('%r is read twice' % (self.fname,))
+        self.fd = fork_lines(lambda: lookup_lines(
+            self.fname, self.data_range(), self.lookup, self.order, self.samples
+        ))
+        return self.fd
+    def get_fileobj(self):
+        return os.fdopen(self._open(), 'r')
+    def cmd_arg(self):
+        return '/dev/fd/%d' % (self._open(),)
+    def range_cmds(self, parts):
+        return None # lines are selected by a forked process, can not be split
+
+class ColumnFile(InputFile):
+    """
+    Column store directory (tabkit.colstore), only files of
+    selected fields are read. Lines are written by a forked process
+    into a pipe.
+    """
+    def __init__(self, fname, header=None, field_names=None):
+        if header:
+            raise Exception('Can not use header with column store %r' % (fname,))
+        self.fname = fname
+        self.rows, self.header = read_schema(fname)
+        self.field_names = field_names
+        if field_names is not None:
+            desc = self.desc()
+            fields = [desc.get_field(name) for name in field_names]
+            self.header = make_header(DataDesc(fields, [], meta=desc.meta))
+        self.fd = None
+    def select(self, field_names):
+        """
+        ColumnFile reading only field_names fields, in that order.
+        """
+        return ColumnFile(self.fname, field_names=field_names)
+    def _open(self):
+        if self.fd is not None:
+            raise Exception('%r is read twice' % (self.fname,))
+        field_names = self.field_names
+        if field_names is None:
+            field_names = [field.name for field in self.desc().fields]
+        self.fd = fork_lines(lambda: read_lines(self.fname, field_names))
+        return self.fd
+    def get_fileobj(self):
+        return os.fdopen(self._open(), 'r')
+    def cmd_arg(self):
+        return '/dev/fd/%d' % (self._open(),)
+    def is_stdin(self):
+        return False
+
+class BlockGzipFile(GzipFile):
+    """
+    Gzip file written by blocks (tabkit.blockgz), blocks are
+    decompressed by several threads in a forked process writing
+    data into a pipe, and can be split among commands.
+    """
+    def __init__(self, fname, header=None):
+        super(BlockGzipFile, self).__init__(fname, header)
+        self.index = read_block_index(fname)
+        self.fd = None
+    def _data_blocks(self):
+        blocks = read_blocks(self.fname, self.index, multiprocessing.cpu_count())
+        if self.has_header:
+            skip = len(self.header)
+            for block in blocks:
+                if len(block) > skip:
+                    yield block[skip:]
+                    break
+                skip -= len(block)
+        for block in blocks:
+            yield block
+    def _open(self):
+        if self.fd is not None:
+            raise Exception('%r is read twice' % (self.fname,))
+        self.fd = fork_lines(self._data_blocks)
+        return self.fd
+    def get_fileobj(self):
+        return os.fdopen(self._open(), 'r')
+    def cmd_arg(self):
+        return '/dev/fd/%d' % (self._open(),)
+    def data_range(self):
+        """
+        Byte range of the compressed blocks.
+        """
+        return 0, self.index[-1][0]
+    def range_cmds(self, parts):
+        """
+        Shell commands printing file data in up to parts pieces
+        of whole blocks.
+        """
+        cmds = []
+        for first, end in block_groups(self.index, 0, parts):
+            start, stop = self.index[first][0], self.index[end][0]
+            cmd = 'dd if=%s bs=1M iflag=skip_bytes,count_bytes skip=%d count=%d status=none | %s' % (
+                quote(self.fname), start, stop - start, decompress_cmd('gzip'),
+            )
+            if first == 0 and self.has_header:
+                cmd += ' | tail -qn +2'
+            cmds.append(cmd)
+        return cmds
+
+def input_file_from_cmdline_arg(fname, header=None, gzip=False, lookup=None):
     if fname == '-':
         return StdinFile(header)
     elif os.path.isfile(fname):
+        if lookup is not None:
+            if gzip:
+                raise Exception('Index lookups are not supported for gzipped files')
+            return IndexedFile(fname, lookup, header)
         if gzip:
-            return GzipFile(fname, header)
+            compression = sniff_compression(fname)
+            if compression is None:
+                return PlainFile(fname, header)
+            if compression == 'gzip' and is_block_gzip(fname):
+                return BlockGzipFile(fname, header)
+            return GzipFile(fname, header, compression)
         else:
             return PlainFile(fname, header)
+    elif os.path.isdir(fname) and is_colstore(fname):
+        if lookup is not None:
+            raise Exception('Index lookups are not supported for column stores')
+        return ColumnFile(fname, header)
     elif os.path.exists(fname):
         if fname.startswith('/dev/fd/'):
             return FdFile(fname, int(fname.split('/', 3)[3]), header)
@@ -135,8 +384,126 @@ def input_file_from_cmdline_arg(fname, header=None, gzip=False):
     else:
         raise Exception('File does not exist: %r' % (fname,))
 
+def _put(queue, item, stop):
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return
+        except Full:
+            pass
+
+def _read_file_blocks(ifile, fobj, queue, block_size, stop):
+    """
+    Puts blocks of file data into queue, then None
+    (or exc_info tuple on error).
+    """
+    try:
+        fobj = fobj or ifile.get_fileobj()
+        with fobj:
+            for block in iter(lambda: fobj.read(block_size), ''):
+                if stop.is_set():
+                    return
+                _put(queue, block, stop)
+        _put(queue, None, stop)
+    except Exception:
+        _put(queue, sys.exc_info(), stop)
+
+def _block_lines(blocks):
+    """
+    Lines of data given by blocks.
+
+    >>> list(_block_lines(['a\\nb', 'c', '\\nd\\ne\\n', 'f']))
+    ['a\\n', 'bc\\n', 'd\\n', 'e\\n', 'f']
+    """
+    tail = ''
+    for block in blocks:
+        start = 0
+        if tail:
+            pos = block.find('\n')
+            if pos < 0:
+                tail += block
+                continue
+            yield tail + block[:pos + 1]
+            start = pos + 1
+        end = max(block.rfind('\n') + 1, start)
+        if end > start:
+            for line in StringIO(buffer(block, start, end - start)):
+                yield line
+        tail = block[end:]
+    if tail:
+        yield tail
+
+def read_ahead_lines(ifiles, ahead=2, block_size=1 << 20, max_blocks=4):
+    """
+    Lines of input files in their order. Up to ahead next files are
+    opened and read by blocks in a thread pool while lines of the current
+    one are consumed, up to max_blocks blocks of a file are kept in memory.
+    Streams (stdin, fds) are read when their turn comes.
+    Files are read one by one without the pool if there is only one
+    file or some are read by forked processes (indexed, column store
+    and block gzip ones), which must not be forked while pool threads
+    run and read ahead by themselves anyway.
+
+    >>> import tempfile
+    >>> fobjs = [tempfile.NamedTemporaryFile() for num in range(4)]
+    >>> for num, fobj in enumerate(fobjs):
+    ...     fobj.write('# a\\n' + '%d\\n' % (num,) * 3 + 'last'); fobj.flush()
+    >>> ifiles = [PlainFile(fobj.name) for fobj in fobjs]
+    >>> ''.join(read_ahead_lines(ifiles, ahead=1, block_size=3)) == ''.join(
+    ...     '%d\\n' % (num,) * 3 + 'last' for num in range(4)
+    ... )
+    True
+    """
+    ifiles = list(ifiles)
+    files = [ifile for ifile in ifiles if not isinstance(ifile, FdFile)]
+    if len(files) <= 1 or any(isinstance(ifile, (IndexedFile, ColumnFile, BlockGzipFile)) for ifile in files):
+        for ifile in ifiles:
+            with ifile.get_fileobj() as fobj:
+                for line in fobj:
+                    yield line
+        return
+    pool = ThreadPool(ahead + 1)
+    stop = threading.Event()
+    queues = {}
+    def submit(num):
+        if num >= len(ifiles) or isinstance(ifiles[num], FdFile):
+            return
+        ifile = ifiles[num]
+        fobj = None
+        if isinstance(ifile, GzipFile):
+            # decompressors are started by one thread only, so they
+            # do not inherit pipes of each other
+            fobj = ifile.get_fileobj()
+        queues[num] = Queue(max_blocks)
+        pool.apply_async(_read_file_blocks, (ifile, fobj, queues[num], block_size, stop))
+
+    def queue_blocks(queue):
+        while True:
+            block = queue.get()
+            if block is None:
+                return
+            if isinstance(block, tuple):
+                raise block[0], block[1], block[2]
+            yield block
+
+    try:
+        for num in xrange(ahead + 1):
+            submit(num)
+        for num, ifile in enumerate(ifiles):
+            if num in queues:
+                for line in _block_lines(queue_blocks(queues.pop(num))):
+                    yield line
+            else:
+                with ifile.get_fileobj() as fobj:
+                    for line in fobj:
+                        yield line
+            submit(num + ahead + 1)
+    finally:
+        stop.set()
+        pool.terminate()
+
 class FilesList(object):
-    def __init__(self, fnames, stdin_fallback=True, header=None, gzip=False):
+    def __init__(self, fnames, stdin_fallback=True, header=None, gzip=False, lookup=None):
         self.header = header
         self.input_files = []
 
@@ -145,7 +512,7 @@ class FilesList(object):
 
         got_stdin = False
         for fname in fnames:
-            input_file = input_file_from_cmdline_arg(fname, header, gzip=gzip)
+            input_file = input_file_from_cmdline_arg(fname, header, gzip=gzip, lookup=lookup)
             if input_file.is_stdin():
                 if got_stdin:
                     raise Exception('"-" specified as input file more than once')
@@ -186,14 +553,30 @@ class FilesList(object):
             order = []
         return DataDesc(fields, order)
 
+    def range_cmds(self, parts):
+        """
+        Shell commands printing data of all files in about parts pieces
+        split on line boundaries, None if some file is neither a regular
+        one nor a block gzip one (or is read with index lookups).
+        Pieces are distributed among files proportionally to their sizes.
+        """
+        if not all(
+                isinstance(ifile, (PlainFile, BlockGzipFile)) and not isinstance(ifile, IndexedFile)
+                for ifile in self.input_files
+                ):
+            return None
+        sizes = [ifile.data_range()[1] - ifile.data_range()[0] for ifile in self.input_files]
+        total_size = sum(sizes) or 1
+        cmds = []
+        for ifile, size in zip(self.input_files, sizes):
+            cmds.extend(ifile.range_cmds(max(1, parts * size // total_size)))
+        return cmds
+
     def concat_meta(self):
         return proper_reduce(merge_meta, (desc.meta for fname, desc in self.names_descs()))
 
     def readlines(self):
-        for ifile in self.input_files:
-            with ifile.get_fileobj() as fobj:
-                for line in fobj:
-                    yield line
+        return read_ahead_lines(self.input_files)
 
     def cmd_args(self):
         args = []
@@ -227,11 +610,11 @@ def parse_renamings(renaming_opts, descs):
             else:
                 raise Exception("bad renaming rule: %r (no filenum)" % (rename,))
 
-            if filenum_str in ['1', '2']:
+            if filenum_str.isdigit() and 1 <= int(filenum_str) <= len(descs):
                 filenum = int(filenum_str) - 1
             else:
-                raise Exception("bad renaming rule: %r (wrong filenum %r, must be 1 or 2)" % (
-                    rename, filenum_str
+                raise Exception("bad renaming rule: %r (wrong filenum %r, must be from 1 to %d)" % (
+                    rename, filenum_str, len(descs)
                 ))
 
             if old_name == '*':
@@ -292,6 +675,12 @@ def add_awk_exec(parser):
         help="use AWK_EXEC as awk executable",
     )
 
+def add_engine(parser):
+    parser.add_option(
+        '--engine', dest="engine", type="choice", choices=['awk', 'python'], default='awk',
+        help="expressions backend: awk (default) or python (runs in-process, awk is not needed)",
+    )
+
 def add_meta(parser):
     parser.add_option(
         '--meta', dest="meta", action="store",
@@ -306,6 +695,19 @@ def add_meta(parser):
         help="specify meta keys to pass into result"
     )
 
+def add_index_lookup(parser):
+    parser.add_option(
+        '--range', dest="ranges", action="append",
+        help=(
+            "read only lines with the first #ORDER field in range LO..HI "
+            "(LO.. and ..HI are open ranges), uses FILE.tidx written by tindex"
+        ),
+    )
+    parser.add_option(
+        '--keys-from', dest="keys_from", action="append",
+        help="read only lines with the first #ORDER field equal to one of keys in KEYS_FROM file",
+    )
+
 class OptUtils(object):
     add_header = staticmethod(add_header)
     add_no_out_header = staticmethod(add_no_out_header)
@@ -313,6 +715,8 @@ class OptUtils(object):
     add_print_cmd = staticmethod(add_print_cmd)
     add_awk_exec = staticmethod(add_awk_exec)
     add_meta = staticmethod(add_meta)
+    add_index_lookup = staticmethod(add_index_lookup)
+    add_engine = staticmethod(add_engine)
 
 class OptparsePrettyFormatter(IndentedHelpFormatter):
     def format_description(self, description):
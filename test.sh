@@ -27,10 +27,20 @@ trap "rm -rf $testdir" EXIT
 
 python -m doctest tabkit/awk.py
 python -m doctest tabkit/awk_grp.py
+python -m doctest tabkit/awk_py.py
+python -m doctest tabkit/awk_pipe.py
 python -m doctest tabkit/header.py
 python -m doctest tabkit/datasrc.py
+python -m doctest tabkit/_fileparser.py
 python -m doctest tabkit/pyparser.py
 python -m doctest tabkit/safe_popen.py
+python -m doctest tabkit/utils.py
+python -m doctest tabkit/index.py
+python -m doctest tabkit/join.py
+python -m doctest tabkit/bloom.py
+python -m doctest tabkit/kvstore.py
+python -m doctest tabkit/colstore.py
+python -m doctest tabkit/blockgz.py
 PYTHONPATH=. python tabkit/test_tregroup.py
 
 ./_compile_tools.py "$testdir"
@@ -111,6 +121,16 @@ diff -ub - <(
 1   2
 TEST_END
 
+## ТЕСТ tmap_awk --engine=python #############
+diff -ub - <(
+    echo -e "# a:str b c\n1-2\t02\t3\n2-2\t2\t4" \
+    | tmap_awk --engine=python -f 'b==2' -o 'x=unjoin("-", a, 0); y=b*c; z="(",a,")"'
+) <<-"TEST_END"
+# x y z:str
+1 6 (1-2)
+2 8 (2-2)
+TEST_END
+
 ## ТЕСТ tgrp_awk #############
 
 function test_grp {
@@ -205,6 +225,81 @@ echo {s:str,i:int,l:long,f:float,b:bool,a:any}:{first,last,max,min,sum,product,m
     md5sum - |
     diff -ub <(echo '1cd04f4afcb24b26cfe57059ee9f9fb4 -') -
 
+## ТЕСТ tgrp_awk --engine=python #############
+diff -ub - <(
+    echo -e "# k a:str b:int c:float d\nk\t1\t2\t0.5\ttest\nk\t10\t20\t5\ttest2\nm\t3\t1\t1\tx" \
+    | tgrp_awk --engine=python -G "k" -o "A=sum(a);B=max(b);C=ifmin(c,d);D=concat(d)"
+) <<-TEST_END
+# k A:float B:int C D:str
+k 11 20 test test,test2
+m 3 1 x x
+TEST_END
+
+# --hash: группировка несортированного входа
+diff -ub - <(
+    echo -e "# k v\nb\t1\na\t2\nb\t3\nc\t3\na\t2" \
+    | tgrp_awk --engine=python --hash -G k -o 's=sum(v); u=concat_uniq(v); m=median(v)'
+) <<-TEST_END
+# k s:float u:str m:float
+b 4 1,3 2
+a 4 2 2
+c 3 3 3
+TEST_END
+
+# та же семантика, что и у awk
+echo {s:str,i:int,l:long,f:float,b:bool,a:any}:{first,last,max,min,sum,product,median,var,avg} |
+    sed 's/[ :]/\n/g' |
+    xargs -n 3 bash -c 'echo "$2($0:$1)"; echo -e "# $0:$1\n1" | tgrp_awk --engine=python -o "r=$2($0)"' |
+    md5sum - |
+    diff -ub <(echo '1cd04f4afcb24b26cfe57059ee9f9fb4 -') -
+
+
+## ТЕСТ tgrp_awk --partial/--merge ######
+# объединение состояний частей входа дает тот же результат, что и группировка целиком
+GRP_DATA="# k v x\na\t1\tp\na\t3\tq\nb\t2\tr\nb\t5\ts\nb\t0.1\tr\nc\t7\tt"
+GRP_EXPRS='s=sum(v); a=avg(v); n=cnt(); m=median(v); u=concat_uniq(x); cs=concat_sorted(x); im=ifmax(v,x); mn=min(v); f=first(x); l=last(x); vr=var(v); c=concat(x)'
+for engine in awk python; do
+    diff -ub <(echo -e "$GRP_DATA" | tgrp_awk --engine=$engine -G k -o "$GRP_EXPRS") <(
+        cat \
+            <(echo -e "$GRP_DATA" | head -4 | tgrp_awk --engine=$engine --partial -G k -o "$GRP_EXPRS") \
+            <(echo -e "$GRP_DATA" | sed 2,4d | tgrp_awk --engine=$engine --partial -G k -o "$GRP_EXPRS" | tail -n +2) \
+        | tgrp_awk --engine=$engine --merge
+    )
+done
+
+# части в произвольном порядке
+diff -ub - <(
+    cat \
+        <(echo -e "$GRP_DATA" | sed 2,4d | tgrp_awk --engine=python --hash --partial -G k -o 's=sum(v); m=median(v)') \
+        <(echo -e "$GRP_DATA" | head -4 | tgrp_awk --engine=python --hash --partial -G k -o 's=sum(v); m=median(v)' | tail -n +2) \
+    | tgrp_awk --engine=python --hash --merge
+) <<-TEST_END
+# k s:float m:float
+b 7.1 2
+c 7 7
+a 4 2
+TEST_END
+
+
+## ТЕСТ tpipe #############
+diff -ub - <(
+    echo -e "# k a b\nx\t1\tabc\nx\t2\tabcdefghijkl\ny\t0\tzz\ny\t3\tq\nz\t5\tabcdefghijklmnop" \
+    | tpipe 'filter: a>0' 'map: k; c=length(b)' 'grp k: s=sum(c); n=cnt()' 'filter: s>10'
+) <<-TEST_END
+# k s:float n:int
+x 15 2
+z 16 1
+TEST_END
+
+# NR и сравнение strnum как при чтении из пайпа
+diff -ub - <(
+    echo -e "# k a\nx\t1\ny\t2\nz\t3" \
+    | tpipe 'map: k; c=a,"0"' 'filter: k!="y"' 'map: c; d=NR; e=c==10'
+) <<-TEST_END
+# c d e:bool
+10 1 1
+30 2 0
+TEST_END
 
 ## ТЕСТ tsrt #############
 
@@ -226,6 +321,34 @@ sort: -:3: disorder: 03
 sort: TEST_PASSED
 TEST_END
 
+# -P: файл сортируется по частям параллельно, части сливаются sort -m
+(echo "# x y"; seq 1000 | awk '{print ($1 * 7) % 13 "\t" $1}') > $testdir/tsrt_parallel
+diff -ub <(tsrt -k x:num -k y:desc $testdir/tsrt_parallel) <(tsrt -P 4 -k x:num -k y:desc $testdir/tsrt_parallel)
+# -S делится между частями, слиянию -S не нужен
+diff -ub - <(tsrt -P 2 -S 10M -k x --print-cmd $testdir/tsrt_parallel | grep -o -- '-S [^ ]*') <<-TEST_END
+-S 5120K
+-S 5120K
+TEST_END
+
+## ТЕСТ tindex #############
+
+# --range и --keys-from читают только блоки, указанные в индексе
+(echo "# k v #ORDER: k"; seq 1000 | sort | awk '{print $1 "\t" $1 * 2}') > $testdir/tindex_data
+echo -e "17\n500\nnokey" > $testdir/tindex_data_keys
+tindex -b 1 $testdir/tindex_data
+test -s $testdir/tindex_data.tidx
+diff -ub - <(tcat --range 998..999 --keys-from $testdir/tindex_data_keys $testdir/tindex_data) <<-TEST_END
+# k v #ORDER: k
+17 34
+500 1000
+998 1996
+999 1998
+TEST_END
+# без индекса файл просматривается целиком
+tcut -f v --range 2..3 $testdir/tindex_data > $testdir/tindex_data_indexed
+rm $testdir/tindex_data.tidx
+diff -ub $testdir/tindex_data_indexed <(tcut -f v --range 2..3 $testdir/tindex_data)
+
 ## ТЕСТ tcut #############
 
 diff -ub - <(tcut -f b,d --print-cmd <(echo "# a b c d") <(echo "# b d") <(echo "# b d")) <<-TEST_END
@@ -246,6 +369,40 @@ diff -ub - <(
 1 2 0.5 test 0.25 0 4 1
 TEST_END
 
+## ТЕСТ tcat --to-col #############
+
+# колоночное хранилище: tcut читает только файлы нужных колонок, в любом порядке
+echo -e "# a:int b:float c #ORDER: a\n1\t0.5\tx\n2\t1.50\ty" > $testdir/colstore_src
+tcat --to-col $testdir/colstore $testdir/colstore_src
+diff -ub $testdir/colstore_src <(tcat --from-col $testdir/colstore)
+diff -ub - <(tcut -f c,a $testdir/colstore) <<-TEST_END
+# c a:int #ORDER: a
+x 1
+y 2
+TEST_END
+
+## ТЕСТ tcat -z #############
+
+# формат определяется по сигнатуре, файлы распаковываются одновременно, вывод в порядке файлов
+echo -e "# a\n1" | gzip > $testdir/zcat_1
+echo -e "# a\n2" > $testdir/zcat_2
+echo -e "# a\n3" | gzip > $testdir/zcat_3
+diff -ub - <(tcat -z $testdir/zcat_1 $testdir/zcat_2 $testdir/zcat_3) <<-TEST_END
+# a #SIZE: 18
+1
+2
+3
+TEST_END
+
+## ТЕСТ tcat --to-gz #############
+
+# файл, сжатый блоками, читается gzip -cd, tsrt -P делит его по блокам
+(echo "# a:int"; seq 100000 | sort) > $testdir/blockgz_src
+tcat --to-gz $testdir/blockgz $testdir/blockgz_src
+diff -ub $testdir/blockgz_src <(gzip -cd $testdir/blockgz)
+diff -ub <(tail -n +2 $testdir/blockgz_src) <(tcat -z -N $testdir/blockgz)
+diff -ub <(tsrt -k a:num $testdir/blockgz_src) <(tsrt -z -P 3 -k a:num $testdir/blockgz)
+
 ## ТЕСТ tjoin #############
 
 # tjoin с составным ключом
@@ -303,6 +460,52 @@ diff -ub - <(
 2   20  z2
 TEST_END
 
+# tjoin -v с составным ключом и проверка сортировки входа
+diff -ub - <(
+    ./tjoin -j x,y -v 2 \
+        <(echo $'#x y #ORDER: x, y\n1\t10\n2\t20') \
+        <(echo $'#x y #ORDER: x, y\n2\t20\n3\t30')
+) <<-TEST_END
+# x y #ORDER: x y
+3   30
+TEST_END
+
+diff -ub - <(
+    ./tjoin -j x,y \
+        <(echo $'#x y #ORDER: x, y\n1\t10\n4\t40') \
+        <(echo $'#x y #ORDER: x, y\n3\t30\n2\t20') \
+    2>&1
+) <<-TEST_END
+# x y #ORDER: x y
+./tjoin: Exception: File 2 is not sorted by join key: '2;20' after '3;30'
+TEST_END
+
+# tjoin трех файлов, -a и переименование для третьего файла
+diff -ub - <(
+    ./tjoin -j x -a 3 -e NA -r 3.y=y3 \
+        <(echo $'# x y #ORDER: x\n1\t10\n2\t20\n4\t40') \
+        <(echo $'# x z #ORDER: x\n1\tz1\n2\tz2\n2\tz22') \
+        <(echo $'# x y #ORDER: x\n2\t200\n3\t300\n4\t400')
+) <<-TEST_END
+# x y z y3 #ORDER: x
+2   20  z2  200
+2   20  z22 200
+3   NA  NA  300
+4   40  NA  400
+TEST_END
+
+# порядок на выходе обрывается на первом поле #ORDER, которого нет в выводе
+diff -ub - <(
+    ./tjoin -j a -o a,b,c,d \
+        <(echo $'# a x b #ORDER: a x b\n1\t1\t2\n1\t2\t1') \
+        <(echo $'# a c #ORDER: a c\n1\tc') \
+        <(echo $'# a d #ORDER: a d\n1\td')
+) <<-TEST_END
+# a b   c   d #ORDER: a
+1   2   c   d
+1   1   c   d
+TEST_END
+
 # шаблонное переименование
 diff -ub - <(
     ./tjoin -1 a -2 a2  -r "2.*=*2" \
@@ -333,6 +536,60 @@ diff -ub - <(
 ./tjoin: Exception: Field name 'b2' presents in both files, use -r/-o/-c option to resolve conflict
 TEST_END
 
+# tjoin --hash: второй файл в памяти, первый не сортирован
+diff -ub - <(
+    ./tjoin -j a --hash 2 -a 1 -e NA \
+        <(echo -e "# a x #ORDER: x\nk2\t1\nk1\t2\nk3\t3") \
+        <(echo -e "# a y\nk1\ty1\nk2\ty2\nk1\ty3")
+) <<-TEST_END
+# a x y #ORDER: x
+k2  1   y2
+k1  2   y1
+k1  2   y3
+k3  3   NA
+TEST_END
+
+# tjoin --hash: поле первого файла с именем ключа второго файла берётся из первого файла
+diff -ub - <(
+    ./tjoin -1 a -2 b --hash 2 \
+        <(echo -e "# a b\n1\tB1") \
+        <(echo -e "# b c\n1\tC1")
+) <<-TEST_END
+# a b   c
+1   B1  C1
+TEST_END
+
+## ТЕСТ tbloom #############
+
+echo -e "# k\nb\nc" > $testdir/tbloom_keys
+tbloom build -f k -o $testdir/tbloom.bf $testdir/tbloom_keys
+diff -ub - <(echo -e "# k v\na\t1\nb\t2\nc\t3" | tmap_awk --engine=python -f "in_bloom(\"$testdir/tbloom.bf\", k)") <<-TEST_END
+# k v
+b   2
+c   3
+TEST_END
+
+# --prefilter: строки первого файла с ключами не из фильтра не доходят до join
+diff -ub - <(
+    tjoin -j k --prefilter 1:$testdir/tbloom.bf \
+        <(echo -e "# k v #ORDER: k\na\t1\nb\t2") \
+        <(echo -e "# k #ORDER: k\nb\nc")
+) <<-TEST_END
+# k v #ORDER: k
+b   2
+TEST_END
+
+## ТЕСТ tdict #############
+
+echo -e "a\tA\nc\tC\na\tA2" > $testdir/tdict_map
+tdict build -o $testdir/tdict_data $testdir/tdict_map
+diff -ub - <(echo -e "# k\na\nb\nc" | tmap_awk --engine=python -o "k;v=map_from_file(\"$testdir/tdict_data\", k, \"-\")") <<-TEST_END
+# k v
+a   A2
+b   -
+c   C
+TEST_END
+
 ## ТЕСТ tproject #############
 
 diff -ub - <(
@@ -358,6 +615,34 @@ a = 1
 b = 2
 TEST_END
 
+diff --label "LINE ${LINENO}: tparallel --block-size" -ub <(seq 1 10000) <(seq 1 10000 | tparallel -n -N -P 3 --block-size 100 cat | sort -n)
+
+diff --label "LINE ${LINENO}: tparallel --by" -ub <(seq 1 1000 | sed 's/^/2 /') <(
+    (echo '# k'; seq 1 1000; seq 1 1000) | tparallel -N -P 3 --by k --block-size 100 sh -c 'sed 1d | sort | uniq -c' \
+        | awk '{print $1, $2}' | sort -n -k2
+)
+
+diff --label "LINE ${LINENO}: tparallel --keep-order" -ub <(
+    (echo '# x'; seq 1 10000) | tsrt -k x | tmap_awk -o 'x;y=x*2'
+) <(
+    (echo '# x'; seq 1 10000) | tsrt -k x | tparallel -P 3 --keep-order --block-size 100 tmap_awk -o 'x;y=x*2'
+)
+
+diff --label "LINE ${LINENO}: tparallel sorted merge" -ub <(
+    (echo '# x y'; seq 1 10000 | sed 's/$/\t1/') | tsrt -k x:num:desc
+) <(
+    (echo '# x y'; seq 1 10000 | sed 's/$/\t1/') | tsrt -k x:num:desc | tparallel -P 3 --block-size 100 cat
+)
+
+diff --label "LINE ${LINENO}: tparallel -P auto --stats" -ub <(seq 1 10000) <(
+    seq 1 10000 | tparallel -n -N -P auto:3 --stats --block-size 100 cat 2>/dev/null | sort -n
+)
+
+# блоки по умолчанию начинаются с маленьких, короткий вход достаётся всем воркерам
+diff --label "LINE ${LINENO}: tparallel default blocks" -ub <(echo 4) <(
+    seq 1 20000 | tparallel -n -N -P 4 --stats cat 2>&1 >/dev/null | awk '/: worker / && $4 > 0' | wc -l
+)
+
 ## ТЕСТ tregroup #############
 diff -ub - <(
     echo -en "\